@@ -0,0 +1,498 @@
+"""Headless performance benchmarks for the Emotion Art Generator.
+
+Usage:
+    python benchmark.py particles --counts 20 1000 10000 100000
+    python benchmark.py elements --count 10000
+    python benchmark.py suite --output results.json [--baseline baseline.json]
+    python benchmark.py server --requests 2000 --concurrency 16 --workers 4
+    python benchmark.py scene --count 1000000
+    python benchmark.py viewport --count 20000 --zooms 1 4 16 64
+    python benchmark.py startup --repeat 10
+    python benchmark.py generate --count 100000
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import threading
+import http.client
+import argparse
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+
+# Render offscreen; the benchmarks never open a window or an audio device
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+# Leave signals to Python so worker pools can be terminated
+os.environ.setdefault("SDL_NO_SIGNAL_HANDLERS", "1")
+
+import pygame
+import emotion_art
+
+# Every benchmark renders the same scenes
+SEED = 1234
+
+SUITE_SIZES = [(800, 600), (1920, 1080), (3840, 2160)]
+SUITE_DENSITIES = [1, 4, 16]
+
+
+def bench_particles(counts, frames, size):
+    """Measure update + draw time of the Excited animation for each particle count"""
+    surface = pygame.Surface(size)
+    print(f"{'particles':>10} {'update ms':>10} {'draw ms':>10} {'frame ms':>10} {'fps':>8}")
+    results = []
+    for count in counts:
+        generator = emotion_art.EmotionArtGenerator(particle_count=count)
+        generator.generate_art("Excited", SEED)
+        generator.draw(surface)
+
+        update_time = draw_time = 0.0
+        for _ in range(frames):
+            start = time.perf_counter()
+            generator.update()
+            middle = time.perf_counter()
+            generator.draw(surface, dirty_only=True)
+            end = time.perf_counter()
+            update_time += middle - start
+            draw_time += end - middle
+
+        update_ms = update_time / frames * 1000
+        draw_ms = draw_time / frames * 1000
+        frame_ms = update_ms + draw_ms
+        fps = 1000 / frame_ms if frame_ms else float("inf")
+        print(f"{count:>10} {update_ms:>10.3f} {draw_ms:>10.3f} {frame_ms:>10.3f} {fps:>8.1f}")
+        results.append({"particles": count, "update_ms": update_ms, "draw_ms": draw_ms, "frame_ms": frame_ms})
+    return results
+
+
+def build_scene(generator, count):
+    """Collect at least count static elements by generating every emotion repeatedly"""
+    elements = []
+    while len(elements) < count:
+        for emotion in emotion_art.EMOTION_PALETTES:
+            generator.generate_art(emotion)
+            elements.extend(generator.art_elements)
+    return elements[:count]
+
+
+def bench_elements(count, repeat, size):
+    """Measure memory per element and static-layer draw throughput on a large scene"""
+    generator = emotion_art.EmotionArtGenerator()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    elements = build_scene(generator, count)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    bytes_per_element = (after - before) / len(elements)
+
+    generator.art_elements = elements
+    generator.invalidate_scene()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generator.build_static_layer(size)
+        best = min(best, time.perf_counter() - start)
+
+    print(f"elements:            {len(elements)}")
+    print(f"bytes per element:   {bytes_per_element:.1f}")
+    print(f"draw time (best):    {best * 1000:.1f} ms")
+    print(f"draw throughput:     {len(elements) / best:,.0f} elements/s")
+    return {"elements": len(elements), "bytes_per_element": bytes_per_element, "draw_ms": best * 1000}
+
+
+def bench_viewport(count, size, zooms, repeat):
+    """Compare static-layer draw time with and without culling on a large scene at increasing zoom"""
+    generator = emotion_art.EmotionArtGenerator()
+    generator.art_elements = build_scene(generator, count)
+    generator.particles = None
+    generator.invalidate_scene()
+    start = time.perf_counter()
+    generator.get_spatial_index()
+    print(f"elements:            {count}")
+    print(f"index build:         {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'zoom':>6} {'visible':>9} {'cull ms':>9} {'draw ms':>9} {'unculled':>9} {'pan ms':>9}")
+    results = {}
+
+    def draw_all(view):
+        # What build_static_layer did before culling: every element, clipped by pygame
+        layer = pygame.Surface(size)
+        for element in generator.art_elements:
+            emotion_art.ELEMENT_RENDERERS[type(element)](layer, element, view)
+    for zoom in zooms:
+        generator.reset_view()
+        generator.zoom_at(size, (size[0] // 2, size[1] // 2), zoom)
+        view = generator.view(size)
+        cull_ms = median_ms(lambda: generator.visible_elements(view, size), repeat)
+        visible = len(generator.visible_elements(view, size))
+        draw_ms = median_ms(lambda: generator.build_static_layer(size), repeat, setup=emotion_art.sprite_cache.clear)
+        unculled_ms = median_ms(lambda: draw_all(view), repeat, setup=emotion_art.sprite_cache.clear)
+
+        # One drag step: the layer is scrolled and only the exposed strips are drawn
+        generator.static_layer = generator.get_static_layer(size)
+        steps = [0]
+
+        def pan_step():
+            steps[0] += 1
+            sign = 1 if steps[0] % 2 else -1
+            generator.pan(size, 12 * sign, 8 * sign)
+            generator.static_layer = generator.get_static_layer(size)
+        pan_ms = median_ms(pan_step, repeat)
+        print(f"{zoom:>6g} {visible:>9} {cull_ms:>9.2f} {draw_ms:>9.1f} {unculled_ms:>9.1f} {pan_ms:>9.1f}")
+        results[f"x{zoom:g}"] = {"visible": visible, "cull_ms": cull_ms, "draw_ms": draw_ms, "unculled_ms": unculled_ms,
+                                 "pan_ms": pan_ms}
+    return results
+
+
+def bench_startup(repeat):
+    """Time fresh interpreters importing the module, and each ensure_init stage on top"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    steps = [
+        ("python + pygame + numpy", "import pygame, numpy"),
+        ("import emotion_art", "import emotion_art"),
+        ("+ fonts", "import emotion_art; emotion_art.ensure_init(fonts=True)"),
+        ("+ window and audio", "import emotion_art; emotion_art.ensure_init(window=True, audio=True, fonts=True)"),
+    ]
+    results = {}
+    for name, code in steps:
+        command = [sys.executable, "-c", code]
+        result = median_ms(lambda: subprocess.run(command, cwd=here, capture_output=True, check=True), repeat)
+        print(f"{name:<26} {result:8.1f} ms")
+        results[name] = result
+    return results
+
+
+def bench_generate(count, repeat):
+    """Time generate_art for every emotion at the density that yields about count elements"""
+    results = {}
+    print(f"{'':>8} {'elements':>9} {'ms':>9} {'elements/s':>12}")
+    for emotion in emotion_art.EMOTION_PALETTES:
+        generator = emotion_art.EmotionArtGenerator(particle_count=0)
+        generator.generate_art(emotion, SEED)
+        generator = emotion_art.EmotionArtGenerator(particle_count=0, density=count / len(generator.art_elements))
+        elapsed = median_ms(lambda: generator.generate_art(emotion, SEED), repeat)
+        elements = len(generator.art_elements)
+        print(f"{emotion:>8} {elements:>9} {elapsed:>9.1f} {elements / elapsed * 1000:>12,.0f}")
+        results[emotion] = {"elements": elements, "ms": elapsed}
+    return results
+
+
+def median_ms(func, repeat, setup=None):
+    """Median wall time of func() in milliseconds; setup() runs untimed before each call"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def clear_caches(generator):
+    # Cold rasterization: nothing may come from the layer, render or sprite caches
+    generator.invalidate_layers()
+    generator.render_cache.clear()
+    emotion_art.sprite_cache.clear()
+
+
+def bench_suite(emotions, sizes, densities, repeat):
+    """Time generate_art, update, draw, sidebar and background for every configuration.
+
+    Returns a flat {metric name: median ms} dict so runs can be diffed key by key.
+    """
+    results = {}
+    for size in sizes:
+        size_name = f"{size[0]}x{size[1]}"
+        surface = pygame.Surface(size)
+        for density in densities:
+            for emotion in emotions:
+                generator = emotion_art.EmotionArtGenerator(density=density)
+                prefix = f"{emotion}/{size_name}/x{density:g}"
+                results[f"{prefix}/generate_ms"] = median_ms(lambda: generator.generate_art(emotion, SEED), repeat)
+                results[f"{prefix}/update_ms"] = median_ms(generator.update, repeat)
+                results[f"{prefix}/draw_cold_ms"] = median_ms(
+                    lambda: generator.draw(surface), repeat, setup=lambda: clear_caches(generator))
+                generator.draw(surface)
+                results[f"{prefix}/frame_ms"] = median_ms(
+                    lambda: (generator.update(), generator.draw(surface, dirty_only=True)), repeat)
+                print(f"{prefix:<28} generate {results[f'{prefix}/generate_ms']:8.3f}  "
+                      f"update {results[f'{prefix}/update_ms']:7.3f}  "
+                      f"draw cold {results[f'{prefix}/draw_cold_ms']:8.3f}  "
+                      f"frame {results[f'{prefix}/frame_ms']:7.3f} ms")
+
+        background = emotion_art.GradientBackground((230, 245, 255), (180, 210, 255))
+        results[f"background/{size_name}/build_ms"] = median_ms(
+            lambda: background.get(size), repeat, setup=lambda: setattr(background, "surface", None))
+        results[f"background/{size_name}/blit_ms"] = median_ms(lambda: background.draw(surface), repeat)
+
+        sidebar = emotion_art.Sidebar()
+        # Forgetting the last state forces a re-compose, as after a click or hover change
+        results[f"sidebar/{size_name}/compose_ms"] = median_ms(
+            lambda: sidebar.update(size[1], "Calm", True, True, (100, 125)), repeat,
+            setup=lambda: setattr(sidebar, "state", None))
+        results[f"sidebar/{size_name}/unchanged_ms"] = median_ms(
+            lambda: sidebar.update(size[1], "Calm", True, True, (100, 125)), repeat)
+        results[f"sidebar/{size_name}/blit_ms"] = median_ms(lambda: sidebar.draw(surface), repeat)
+        print(f"{'background/sidebar ' + size_name:<28} gradient build {results[f'background/{size_name}/build_ms']:7.3f}  "
+              f"sidebar compose {results[f'sidebar/{size_name}/compose_ms']:7.3f} ms")
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance, min_delta_ms):
+    """Return (name, baseline ms, current ms) for every metric slower than the baseline allows"""
+    regressions = []
+    for name, value in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if value > old * (1 + tolerance) and value - old > min_delta_ms:
+            regressions.append((name, old, value))
+    return regressions
+
+
+def run_suite(args):
+    results = bench_suite(args.emotions, args.sizes, args.densities, args.repeat)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "machine": platform.machine(),
+            "seed": SEED,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=1, sort_keys=True)
+    print(f"Wrote {len(results)} measurements to {args.output}")
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline) as file:
+        baseline = json.load(file)["results"]
+    regressions = compare_to_baseline(results, baseline, args.tolerance, args.min_delta)
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+        return 0
+    print(f"{len(regressions)} regression(s) against {args.baseline}:")
+    for name, old, new in sorted(regressions, key=lambda item: item[2] / item[1], reverse=True):
+        print(f"  {name:<44} {old:9.3f} -> {new:9.3f} ms  ({new / old - 1:+.0%})")
+    return 1
+
+
+def bench_server(requests, concurrency, workers, size, hot_seeds, unique_ratio):
+    """Load-test the HTTP render service on localhost with a mix of repeated and unique seeds"""
+    server = emotion_art.ArtServer(("127.0.0.1", 0), workers)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    rng = random.Random(SEED)
+    emotions = list(emotion_art.EMOTION_PALETTES)
+    paths = []
+    for index in range(requests):
+        # Hot seeds are requested over and over (cache hits and coalescing); the rest are one-offs
+        seed = 10 ** 9 + index if rng.random() < unique_ratio else rng.randrange(hot_seeds)
+        paths.append(f"/art?emotion={rng.choice(emotions)}&seed={seed}&w={size[0]}&h={size[1]}")
+
+    latencies = []
+    failures = []
+
+    def client(chunk):
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        for path in chunk:
+            start = time.perf_counter()
+            connection.request("GET", path)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                failures.append((path, response.status))
+        connection.close()
+
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client, args=(paths[i::concurrency],)) for i in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+    connection.request("GET", "/metrics")
+    metrics = json.loads(connection.getresponse().read())
+    connection.close()
+    server.shutdown()
+    server.server_close()
+
+    latencies.sort()
+    print(f"{requests} requests, {concurrency} clients, {workers} worker(s), {size[0]}x{size[1]}: "
+          f"{requests / elapsed:.1f} req/s")
+    print("client latency ms: " + "  ".join(
+        f"p{q} {emotion_art.percentile(latencies, q) * 1000:.2f}" for q in (50, 95, 99)))
+    print(f"cache hits {metrics['hit']}, coalesced {metrics['coalesced']}, rendered {metrics['rendered']}, "
+          f"errors {metrics['errors']}; render ms p50 {metrics['render_ms']['p50']:.2f}; "
+          f"cache {metrics['cache']['bytes'] / 1024 / 1024:.1f} MB in {metrics['cache']['entries']} entries")
+    if failures:
+        print(f"{len(failures)} failed requests, e.g. {failures[0]}")
+    return metrics
+
+
+def check_scene_round_trip(generator, directory, size):
+    """Return the scene formats whose reloaded scene doesn't render pixel-identical to the original"""
+    expected = pygame.image.tostring(generator.render_artwork(generator.current_emotion, generator.seed, size), "RGB")
+    failed = []
+    for name, extension, lazy in (("scene", "scene", False), ("lazy scene", "scene", True), ("json", "json", False)):
+        # One file per format, so no save goes over a file an earlier loader still has open
+        path = os.path.join(directory, f"check_{name.replace(' ', '_')}.{extension}")
+        generator.save_scene(path)
+        loader = emotion_art.EmotionArtGenerator()
+        loader.load_scene(path, lazy)
+        if lazy:
+            # Saving over the scene's own file must keep it intact
+            loader.save_scene(path)
+        surface = loader.render_artwork(loader.current_emotion, loader.seed, size)
+        if pygame.image.tostring(surface, "RGB") != expected:
+            failed.append(name)
+    return failed
+
+
+def bench_scene(count, size, repeat):
+    """Compare scene file round trips (binary, JSON) with PNG round trips, then a large lazy load.
+
+    Every format is also checked to reload pixel-identical; the failures are
+    returned in results["round_trip_failures"].
+    """
+    generator = emotion_art.EmotionArtGenerator()
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        scene_path = os.path.join(directory, "scene.scene")
+        json_path = os.path.join(directory, "scene.json")
+        png_path = os.path.join(directory, "scene.png")
+        print(f"{'':>8} {'format':>8} {'bytes':>10} {'save ms':>9} {'load ms':>9}")
+        for emotion in emotion_art.EMOTION_PALETTES:
+            generator.generate_art(emotion, SEED)
+            surface = generator.render_artwork(emotion, SEED, size)
+            loader = emotion_art.EmotionArtGenerator()
+            rows = [
+                ("scene", scene_path, lambda: generator.save_scene(scene_path), lambda: loader.load_scene(scene_path, lazy=False)),
+                ("json", json_path, lambda: generator.save_scene(json_path), lambda: loader.load_scene(json_path)),
+                ("png", png_path, lambda: emotion_art.save_png(surface, png_path), lambda: pygame.image.load(png_path)),
+            ]
+            for name, path, save, load in rows:
+                save_ms = median_ms(save, repeat)
+                load_ms = median_ms(load, repeat)
+                file_bytes = os.path.getsize(path)
+                print(f"{emotion:>8} {name:>8} {file_bytes:>10} {save_ms:>9.3f} {load_ms:>9.3f}")
+                results[f"{emotion}/{name}"] = {"bytes": file_bytes, "save_ms": save_ms, "load_ms": load_ms}
+            failures += [f"{emotion}/{name}" for name in check_scene_round_trip(generator, directory, size)]
+        print(f"\nround trip: {'FAILED for ' + ', '.join(failures) if failures else 'all formats render identically'}")
+        results["round_trip_failures"] = failures
+
+        elements = build_scene(generator, count)
+        generator.art_elements = elements
+        generator.particles = None
+        generator.invalidate_scene()
+        start = time.perf_counter()
+        generator.save_scene(scene_path)
+        save_s = time.perf_counter() - start
+        del elements
+        generator.art_elements = []
+
+        start = time.perf_counter()
+        generator.load_scene(scene_path)
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        decoded = sum(1 for _ in generator.art_elements)
+        decode_s = time.perf_counter() - start
+        generator.art_elements = []
+        start = time.perf_counter()
+        generator.load_scene(scene_path, lazy=False)
+        eager_s = time.perf_counter() - start
+
+        file_bytes = os.path.getsize(scene_path)
+        print(f"\n{decoded} elements: {file_bytes / 1024 / 1024:.1f} MB ({file_bytes / decoded:.1f} bytes/element)")
+        print(f"save:                {save_s * 1000:.0f} ms")
+        print(f"lazy load:           {load_ms:.2f} ms")
+        print(f"lazy decode:         {decoded / decode_s:,.0f} elements/s")
+        print(f"eager load:          {eager_s * 1000:.0f} ms")
+        results["large"] = {"elements": decoded, "bytes": file_bytes, "save_ms": save_s * 1000,
+                            "lazy_load_ms": load_ms, "decode_per_s": decoded / decode_s, "eager_load_ms": eager_s * 1000}
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    particles = commands.add_parser("particles", help="frame time against particle count")
+    particles.add_argument("--counts", type=int, nargs="+", default=[20, 1000, 10000, 100000])
+    particles.add_argument("--frames", type=int, default=120)
+    particles.add_argument("--size", type=emotion_art.parse_size, default=(800, 600))
+
+    elements = commands.add_parser("elements", help="memory and draw throughput of a large static scene")
+    elements.add_argument("--count", type=int, default=10000)
+    elements.add_argument("--repeat", type=int, default=5)
+    elements.add_argument("--size", type=emotion_art.parse_size, default=(800, 600))
+
+    suite = commands.add_parser("suite", help="full headless suite with optional baseline comparison")
+    suite.add_argument("--output", default="benchmark_results.json")
+    suite.add_argument("--baseline", help="results file to compare against; exits 1 on regression")
+    suite.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown as a fraction (0.15 = 15%%)")
+    suite.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns smaller than this many ms")
+    suite.add_argument("--emotions", nargs="+", choices=list(emotion_art.EMOTION_PALETTES), default=list(emotion_art.EMOTION_PALETTES))
+    suite.add_argument("--sizes", type=emotion_art.parse_size, nargs="+", default=SUITE_SIZES)
+    suite.add_argument("--densities", type=float, nargs="+", default=SUITE_DENSITIES, help="element-count multipliers")
+    suite.add_argument("--repeat", type=int, default=5)
+
+    server = commands.add_parser("server", help="throughput and latency of the HTTP render service")
+    server.add_argument("--requests", type=int, default=2000)
+    server.add_argument("--concurrency", type=int, default=16)
+    server.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    server.add_argument("--size", type=emotion_art.parse_size, default=(800, 600))
+    server.add_argument("--hot-seeds", type=int, default=20, help="seeds shared between requests")
+    server.add_argument("--unique-ratio", type=float, default=0.2, help="fraction of requests with a fresh seed")
+
+    viewport = commands.add_parser("viewport", help="draw time of a large scene as zooming culls elements")
+    viewport.add_argument("--count", type=int, default=20000)
+    viewport.add_argument("--size", type=emotion_art.parse_size, default=(800, 600))
+    viewport.add_argument("--zooms", type=float, nargs="+", default=[1, 4, 16, 64])
+    viewport.add_argument("--repeat", type=int, default=3)
+
+    startup = commands.add_parser("startup", help="import time and lazy initialization cost")
+    startup.add_argument("--repeat", type=int, default=10)
+
+    generate = commands.add_parser("generate", help="scene generation time for large element counts")
+    generate.add_argument("--count", type=int, default=100000)
+    generate.add_argument("--repeat", type=int, default=3)
+
+    scene = commands.add_parser("scene", help="scene file size and round-trip time against PNG")
+    scene.add_argument("--count", type=int, default=1000000, help="elements in the large lazily loaded scene")
+    scene.add_argument("--size", type=emotion_art.parse_size, default=(1920, 1080), help="PNG size to compare against")
+    scene.add_argument("--repeat", type=int, default=5)
+
+    args = parser.parse_args(argv)
+    if args.command == "suite":
+        sys.exit(run_suite(args))
+    elif args.command == "particles":
+        bench_particles(args.counts, args.frames, args.size)
+    elif args.command == "elements":
+        bench_elements(args.count, args.repeat, args.size)
+    elif args.command == "server":
+        bench_server(args.requests, args.concurrency, args.workers, args.size, args.hot_seeds, args.unique_ratio)
+    elif args.command == "viewport":
+        bench_viewport(args.count, args.size, args.zooms, args.repeat)
+    elif args.command == "startup":
+        bench_startup(args.repeat)
+    elif args.command == "generate":
+        bench_generate(args.count, args.repeat)
+    elif args.command == "scene":
+        results = bench_scene(args.count, args.size, args.repeat)
+        sys.exit(1 if results["round_trip_failures"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,43 @@ import pygame
 import sys
 import random
 import math
+import time
+import gc
+import argparse
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+import csv
+import json
+import io
+from collections import deque
+import queue
+import struct
+import zlib
+from collections import OrderedDict
+import numpy as np
 from pygame import gfxdraw
 import os
+import shlex
+import mmap
+import subprocess
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from pygame import mixer
 
-# Initialize pygame
-pygame.init()
-mixer.init()
+# Posted by worker threads to wake the main loop while it sleeps in pygame.event.wait
+# (pygame itself is only initialized on first use, by ensure_init)
+WAKE_EVENT = pygame.event.custom_type()
 
-# Screen dimensions (initial, but will be dynamic)
-WIDTH, HEIGHT = 800, 600
+# Events after which the window's contents may be stale and need a full repaint (the WINDOW* ones need pygame 2.0.1)
+EXPOSE_EVENTS = tuple(getattr(pygame, name) for name in ("VIDEOEXPOSE", "WINDOWEXPOSED", "WINDOWSHOWN", "WINDOWRESTORED")
+                      if hasattr(pygame, name))
+
+# Initial window size; the window is resizable
+WINDOW_SIZE = (800, 600)
+
+# Reference canvas the generators lay scenes out on; elements store positions as fractions of it
+SCENE_WIDTH, SCENE_HEIGHT = 800, 600
 
 # Colors
 WHITE = (255, 255, 255)
@@ -39,6 +66,108 @@ EMOTION_PALETTES = {
     "Excited": [(255, 0, 110), (131, 56, 236), (58, 134, 255), (255, 159, 243), (253, 230, 138)]
 }
 
+# Number of particles in the Excited animation
+PARTICLE_COUNT = 20
+
+# Particle velocities are in canvas fractions per frame at this rate; update(dt) scales them by dt
+ANIMATION_FPS = 60
+FRAME_TIME = 1 / ANIMATION_FPS
+
+# Longest animation step taken after a stall, so particles never jump across the canvas
+MAX_FRAME_STEP = 0.1
+
+# How long status messages (the save toast) stay on screen
+MESSAGE_DURATION_MS = 3000
+
+# Refresh interval of the profiler overlay
+HUD_REFRESH_MS = 250
+
+# Memory budget for rendered artworks kept by EmotionArtGenerator's render cache
+RENDER_CACHE_BYTES = 64 * 1024 * 1024
+
+# Memory budget for pre-rendered alpha sprites (rings, glows, rotated rects)
+SPRITE_CACHE_BYTES = 32 * 1024 * 1024
+
+# Sprites larger than this are not cached; only the part overlapping the target is rasterized
+MAX_SPRITE_BYTES = 4 * 1024 * 1024
+
+# A sprite missing from the cache is rasterized whole only if at least this
+# fraction of it is visible; otherwise just the visible part is drawn
+PARTIAL_SPRITE_FRACTION = 0.25
+
+# Rotated rects are snapped to this many degrees so scenes can share their sprites
+ROTATION_STEP = 1.0
+
+# zlib level (0-9) used when encoding exported PNGs
+PNG_COMPRESSION = 6
+
+# Pixel memory per band when a high-resolution export is rendered in bands
+EXPORT_TILE_BYTES = 64 * 1024 * 1024
+
+# gfxdraw takes 16-bit coordinates, which caps the size of an export
+MAX_EXPORT_SIZE = 32767
+
+# Memory budget for encoded PNGs kept by the HTTP render service
+RESPONSE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Largest width or height the HTTP render service accepts
+MAX_SERVE_SIZE = 4096
+
+# Seconds the HTTP render service waits for a render before answering 503 (a worker that died never answers)
+RENDER_TIMEOUT = 60
+
+# Renders the HTTP render service queues per worker before answering 503 to new work
+RENDER_QUEUE_PER_WORKER = 8
+
+# Recent requests the service's throughput and latency percentiles are computed over
+METRICS_WINDOW = 1000
+
+# Zoom factor per mouse wheel notch, and the deepest zoom allowed
+ZOOM_STEP = 1.25
+MAX_ZOOM = 64.0
+
+# Cells per side of the spatial grid used for viewport culling; boxes covering
+# more cells than GRID_MAX_CELLS are tested directly instead of being gridded
+GRID_CELLS = 16
+GRID_MAX_CELLS = 32
+
+# Pixels added around the viewport when culling, covering anti-aliasing and rounding
+CULL_MARGIN = 4
+
+# Identifies scene files and the layout version written by save_scene
+SCENE_MAGIC = b"EMOSCENE"
+SCENE_VERSION = 1
+
+# Elements decoded at a time while rendering a lazily loaded scene
+SCENE_CHUNK = 4096
+
+# Saves that may wait for the background PNG writer before new ones are refused
+EXPORT_QUEUE_SIZE = 4
+
+# Rendered text surfaces kept by the text cache
+TEXT_CACHE_SIZE = 256
+
+# Frames of history the profiler keeps for its rolling percentiles
+PROFILE_WINDOW = 300
+
+# Most recent frames a profile trace keeps (10 minutes at 60 fps), so long sessions stay bounded
+PROFILE_TRACE_FRAMES = 36000
+
+# Above this many moving sprites, one full-area update is cheaper than per-particle dirty rects
+MAX_DIRTY_RECTS = 256
+
+# Above this many particles, sprites drop anti-aliasing for RLE colorkey blits (several times faster)
+MAX_AA_PARTICLES = 1000
+
+# Keyboard help shown at the bottom of the sidebar
+SIDEBAR_INSTRUCTIONS = ["ESC: Hide/Show UI", "M: Toggle Music", "S: Save Artwork"]
+
+# Crossfade between emotion tracks, in milliseconds
+MUSIC_FADE_MS = 1500
+
+# Decoded tracks kept in memory (about 10 MB per minute of stereo audio each)
+MUSIC_CACHE_SIZE = 3
+
 # Emotion music tracks (actual sound files)
 MUSIC_FILES = {
     "Happy": "happy-kids-background-music-364459.mp3",
@@ -48,302 +177,1881 @@ MUSIC_FILES = {
     "Excited": "exciting-upbeat-background-music-300654.mp3"
 }
 
-# Modern font (fallback to Arial if not found)
-try:
-    font = pygame.font.SysFont('Segoe UI', 24)
-    title_font = pygame.font.SysFont('Segoe UI', 40, bold=True)
-except:
-    font = pygame.font.SysFont('Arial', 24)
-    title_font = pygame.font.SysFont('Arial', 40, bold=True)
-
-
-def draw_gradient_background(surface, top_color, bottom_color):
-    """Draw a vertical gradient background"""
-    for y in range(HEIGHT):
-        ratio = y / HEIGHT
+# UI fonts, loaded by ensure_init(fonts=True)
+font = title_font = instr_font = None
+
+
+def ensure_init(window=False, audio=False, fonts=False):
+    """Initialize the parts of pygame a caller needs, on first use.
+
+    Rendering needs no initialization at all, so importing the module (in
+    render workers, the server or the benchmarks) opens no window or audio
+    device and looks up no system fonts. Audio is optional: without a
+    device the app runs silent.
+    """
+    global font, title_font, instr_font
+    if window and not pygame.get_init():
+        pygame.init()
+        if not audio:
+            # pygame.init() also opens the audio device when there is one
+            mixer.quit()
+    if audio and not mixer.get_init():
+        try:
+            mixer.init()
+        except pygame.error as error:
+            print(f"No audio device, music is disabled: {error}")
+    if fonts and font is None:
+        pygame.font.init()
+        # Modern font (fallback to Arial if not found)
+        try:
+            font = pygame.font.SysFont('Segoe UI', 24)
+            title_font = pygame.font.SysFont('Segoe UI', 40, bold=True)
+            instr_font = pygame.font.SysFont('Segoe UI', 16)
+        except:
+            font = pygame.font.SysFont('Arial', 24)
+            title_font = pygame.font.SysFont('Arial', 40, bold=True)
+            instr_font = pygame.font.SysFont('Arial', 16)
+
+
+def build_gradient_surface(size, top_color, bottom_color):
+    """Build a vertical gradient surface of the given size"""
+    width, height = size
+    # Compute one 1px-wide column, then stretch it horizontally in a single scale
+    strip = pygame.Surface((1, max(1, height)))
+    for y in range(height):
+        ratio = y / height
         color = (
             int(top_color[0] * (1 - ratio) + bottom_color[0] * ratio),
             int(top_color[1] * (1 - ratio) + bottom_color[1] * ratio),
             int(top_color[2] * (1 - ratio) + bottom_color[2] * ratio)
         )
-        pygame.draw.line(surface, color, (0, y), (WIDTH, y))
+        strip.set_at((0, y), color)
+    return pygame.transform.scale(strip, (max(1, width), max(1, height)))
+
+
+class GradientBackground:
+    """Gradient background rendered once per (size, top_color, bottom_color)"""
+
+    def __init__(self, top_color, bottom_color):
+        self.top_color = top_color
+        self.bottom_color = bottom_color
+        self.surface = None
+
+    def get(self, size):
+        # Rebuild only when the window size (or palette) changed
+        if self.surface is None or self.surface.get_size() != tuple(size):
+            self.surface = build_gradient_surface(size, self.top_color, self.bottom_color)
+        return self.surface
+
+    def set_colors(self, top_color, bottom_color):
+        if (top_color, bottom_color) != (self.top_color, self.bottom_color):
+            self.top_color = top_color
+            self.bottom_color = bottom_color
+            self.surface = None
+
+    def draw(self, surface):
+        surface.blit(self.get(surface.get_size()), (0, 0))
+
+
+# Shared by draw_gradient_background, so repeated calls with the same size and colors reuse one surface
+default_background = GradientBackground((230, 245, 255), (180, 210, 255))
+
+
+def draw_gradient_background(surface, top_color, bottom_color):
+    """Draw a vertical gradient background sized to the target surface"""
+    default_background.set_colors(top_color, bottom_color)
+    default_background.draw(surface)
+
+
+# Absorbs float error from normalizing, so integer positions on the reference canvas stay exact
+PIXEL_EPSILON = 1e-6
+
+
+class View:
+    """Maps normalized scene coordinates to pixels on a target surface.
+
+    (x, y) is where the canvas's top-left corner lands and (width, height) its
+    size in pixels. Lengths scale with the height and the canvas keeps its
+    aspect ratio, so nothing is ever stretched.
+    """
+    __slots__ = ("x", "y", "width", "height")
+
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def cover(cls, size, zoom=1.0, center=(0.5, 0.5)):
+        """Scale the canvas to cover a target of size, cropped at the edges.
+
+        zoom magnifies it further and center is the scene point put in the
+        middle of the target, clamped so the canvas always fills it.
+        """
+        target_width, target_height = size
+        scale = max(target_width / SCENE_WIDTH, target_height / SCENE_HEIGHT) * zoom
+        width, height = SCENE_WIDTH * scale, SCENE_HEIGHT * scale
+        x = min(0, max(target_width - width, target_width / 2 - center[0] * width))
+        y = min(0, max(target_height - height, target_height / 2 - center[1] * height))
+        return cls(round(x), round(y), width, height)
+
+    def center(self, size):
+        """The scene point shown in the middle of a target of size"""
+        return (size[0] / 2 - self.x) / self.width, (size[1] / 2 - self.y) / self.height
+
+    def scene_rect(self, size, margin=0):
+        """(left, top, right, bottom) of the scene visible on a target of size, widened by margin pixels"""
+        return ((-margin - self.x) / self.width, (-margin - self.y) / self.height,
+                (size[0] + margin - self.x) / self.width, (size[1] + margin - self.y) / self.height)
+
+    def shifted(self, dx, dy):
+        """The same view as seen by a tile whose top-left corner is at (dx, dy)"""
+        return View(self.x - dx, self.y - dy, self.width, self.height)
+
+    def point(self, x, y):
+        return (math.floor(self.x + x * self.width + PIXEL_EPSILON),
+                math.floor(self.y + y * self.height + PIXEL_EPSILON))
+
+    def points(self, points):
+        return [self.point(x, y) for x, y in points]
+
+    def length(self, value):
+        """A length in whole pixels, never less than one"""
+        return max(1, math.floor(value * self.height + PIXEL_EPSILON))
+
+    def __repr__(self):
+        return f"View(x={self.x!r}, y={self.y!r}, width={self.width!r}, height={self.height!r})"
+
+
+def scene_point(x, y):
+    """Normalize a point on the reference canvas"""
+    return x / SCENE_WIDTH, y / SCENE_HEIGHT
+
+
+def scene_length(value):
+    """Normalize a length on the reference canvas (lengths are fractions of its height)"""
+    return value / SCENE_HEIGHT
+
+
+def point_rows(x, y, lengths=None):
+    """Split (n, k) coordinate arrays into n point sequences, each cut to its entry in lengths if given"""
+    rows = zip(x.tolist(), y.tolist())
+    if lengths is None:
+        return [zip(xs, ys) for xs, ys in rows]
+    return [zip(xs[:length], ys[:length]) for (xs, ys), length in zip(rows, np.ravel(lengths).tolist())]
+
+
+def scene_bounds(left, top, right, bottom, reach=0.0):
+    """A normalized bounding box grown by reach, a length, on every side"""
+    reach_x = reach * SCENE_HEIGHT / SCENE_WIDTH
+    return left - reach_x, top - reach, right + reach_x, bottom + reach
+
+
+def points_bounds(points, reach=0.0):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return scene_bounds(min(xs), min(ys), max(xs), max(ys), reach)
+
+
+class Element:
+    """Base class for static scene elements.
+
+    Subclasses list their constructor arguments in fields and the matching
+    packed record layout for scene files in dtype; a point list is stored
+    as a (start, count) slice of the scene's shared vertex array.
+    Positions are fractions of the scene canvas and lengths fractions of its
+    height, so the same scene rasterizes at any size through a View.
+    """
+    __slots__ = ()
+    kind = None
+    fields = ()
+    dtype = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.fields)
+        return f"{type(self).__name__}({fields})"
+
+    def bounds(self):
+        """(left, top, right, bottom) of the area the element may paint, in scene coordinates.
+
+        The default is the whole canvas, so a kind without its own bounds is
+        never culled.
+        """
+        return 0.0, 0.0, 1.0, 1.0
+
+    def intersects(self, left, top, right, bottom):
+        """Finer check than bounds() that the element may paint inside the rectangle"""
+        return True
+
+    def to_record(self, points):
+        """Return this element as a tuple for its dtype, appending any vertices to points"""
+        record = []
+        for name in self.fields:
+            value = getattr(self, name)
+            if name == "points":
+                record += [len(points), len(value)]
+                points.extend(value)
+            else:
+                record.append(value)
+        return tuple(record)
+
+    @classmethod
+    def from_record(cls, record, points):
+        """Rebuild an element from a record tuple and the scene's (n, 2) vertex array"""
+        values = iter(record)
+        args = []
+        for name in cls.fields:
+            if name == "points":
+                start, count = next(values), next(values)
+                args.append(tuple(map(tuple, points[start:start + count].tolist())))
+            elif name == "color":
+                args.append(tuple(next(values).tolist()))
+            else:
+                args.append(next(values))
+        return cls(*args)
+
+    def to_json(self):
+        """Return this element as a plain dict for the JSON debug form of a scene"""
+        record = {"kind": self.kind}
+        for name in self.fields:
+            value = getattr(self, name)
+            record[name] = [list(point) for point in value] if name == "points" else value
+        return record
+
+    @classmethod
+    def from_json(cls, record):
+        """Rebuild an element from a to_json dict"""
+        args = []
+        for name in cls.fields:
+            value = record[name]
+            if name == "points":
+                value = [tuple(point) for point in value]
+            elif name == "color":
+                value = tuple(value)
+            args.append(value)
+        return cls(*args)
+
+
+class Circle(Element):
+    __slots__ = fields = ("x", "y", "size", "color")
+    kind = "circle"
+    dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("size", "<f8"), ("color", "u1", 3)])
+
+    def __init__(self, x, y, size, color):
+        self.x = x
+        self.y = y
+        self.size = size
+        self.color = color
+
+    def bounds(self):
+        return scene_bounds(self.x, self.y, self.x, self.y, self.size)
+
+
+class Polygon(Element):
+    __slots__ = fields = ("points", "color")
+    kind = "polygon"
+    dtype = np.dtype([("start", "<u8"), ("count", "<u4"), ("color", "u1", 3)])
+
+    def __init__(self, points, color):
+        self.points = tuple(points)
+        self.color = color
+
+    def bounds(self):
+        return points_bounds(self.points)
+
+
+class Curve(Element):
+    __slots__ = fields = ("points", "thickness", "color")
+    kind = "curve"
+    dtype = np.dtype([("start", "<u8"), ("count", "<u4"), ("thickness", "<f8"), ("color", "u1", 3)])
+
+    def __init__(self, points, thickness, color):
+        self.points = tuple(points)
+        self.thickness = thickness
+        self.color = color
+
+    def bounds(self):
+        return points_bounds(self.points, self.thickness)
+
+
+class SmoothCurve(Curve):
+    __slots__ = ()
+    kind = "smooth_curve"
+
+
+class Line(Element):
+    __slots__ = fields = ("x1", "y1", "x2", "y2", "thickness", "color")
+    kind = "line"
+    dtype = np.dtype([("x1", "<f8"), ("y1", "<f8"), ("x2", "<f8"), ("y2", "<f8"), ("thickness", "<f8"),
+                      ("color", "u1", 3)])
+
+    def __init__(self, x1, y1, x2, y2, thickness, color):
+        self.x1 = x1
+        self.y1 = y1
+        self.x2 = x2
+        self.y2 = y2
+        self.thickness = thickness
+        self.color = color
+
+    def bounds(self):
+        return scene_bounds(min(self.x1, self.x2), min(self.y1, self.y2), max(self.x1, self.x2), max(self.y1, self.y2),
+                            self.thickness)
+
+    def intersects(self, left, top, right, bottom):
+        # A diagonal line's box covers most of the canvas; clip the segment itself
+        # against the rectangle grown by the line's width (Liang-Barsky)
+        left, top, right, bottom = scene_bounds(left, top, right, bottom, self.thickness)
+        dx, dy = self.x2 - self.x1, self.y2 - self.y1
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, self.x1 - left), (dx, right - self.x1), (-dy, self.y1 - top), (dy, bottom - self.y1)):
+            if p == 0:
+                if q < 0:
+                    return False
+            elif p < 0:
+                t0 = max(t0, q / p)
+            else:
+                t1 = min(t1, q / p)
+            if t0 > t1:
+                return False
+        return True
+
+
+class Ring(Element):
+    __slots__ = fields = ("x", "y", "radius", "color", "alpha")
+    kind = "ring"
+    dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("radius", "<f8"), ("color", "u1", 3), ("alpha", "u1")])
+
+    def __init__(self, x, y, radius, color, alpha):
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.color = color
+        self.alpha = alpha
+
+    def bounds(self):
+        return scene_bounds(self.x, self.y, self.x, self.y, self.radius)
+
+
+class CircleFade(Element):
+    __slots__ = fields = ("x", "y", "size", "color", "alpha")
+    kind = "circle_fade"
+    dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("size", "<f8"), ("color", "u1", 3), ("alpha", "u1")])
+
+    def __init__(self, x, y, size, color, alpha):
+        self.x = x
+        self.y = y
+        self.size = size
+        self.color = color
+        self.alpha = alpha
+
+    def bounds(self):
+        return scene_bounds(self.x, self.y, self.x, self.y, self.size)
+
+
+class RotatedRect(Element):
+    __slots__ = fields = ("x", "y", "width", "height", "rotation", "color")
+    kind = "rotated_rect"
+    dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("width", "<f8"), ("height", "<f8"), ("rotation", "<f8"),
+                      ("color", "u1", 3)])
+
+    def __init__(self, x, y, width, height, rotation, color):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.color = color
+
+    def bounds(self):
+        # Half the diagonal bounds the rectangle at any rotation
+        return scene_bounds(self.x, self.y, self.x, self.y, math.hypot(self.width, self.height) / 2)
+
+
+# Maps each element class to the function that rasterizes it
+ELEMENT_RENDERERS = {}
+
+# Element classes by kind name, for decoding saved scenes
+ELEMENT_KINDS = {}
+
+
+def register_renderer(element_class):
+    """Register the decorated function as the renderer for element_class"""
+    def decorator(func):
+        ELEMENT_RENDERERS[element_class] = func
+        ELEMENT_KINDS[element_class.kind] = element_class
+        return func
+    return decorator
+
+
+@register_renderer(Circle)
+def draw_circle(surface, element, view):
+    x, y = view.point(element.x, element.y)
+    size = view.length(element.size)
+    pygame.gfxdraw.filled_circle(surface, x, y, size, element.color)
+    pygame.gfxdraw.aacircle(surface, x, y, size, element.color)
+
+
+def clip_polygon(points, rect):
+    """Clip a polygon to rect (Sutherland-Hodgman), rounding the new vertices"""
+    def clip_edge(points, inside, cross):
+        clipped = []
+        for (x1, y1), (x2, y2) in zip(points[-1:] + points[:-1], points):
+            if inside(x2, y2):
+                if not inside(x1, y1):
+                    clipped.append(cross(x1, y1, x2, y2))
+                clipped.append((x2, y2))
+            elif inside(x1, y1):
+                clipped.append(cross(x1, y1, x2, y2))
+        return clipped
+
+    def cross_x(x):
+        return lambda x1, y1, x2, y2: (x, round(y1 + (y2 - y1) * (x - x1) / (x2 - x1)))
+
+    def cross_y(y):
+        return lambda x1, y1, x2, y2: (round(x1 + (x2 - x1) * (y - y1) / (y2 - y1)), y)
+
+    left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+    for inside, cross in ((lambda x, y: x >= left, cross_x(left)), (lambda x, y: x <= right, cross_x(right)),
+                          (lambda x, y: y >= top, cross_y(top)), (lambda x, y: y <= bottom, cross_y(bottom))):
+        points = clip_edge(points, inside, cross)
+        if not points:
+            break
+    return points
+
+
+@register_renderer(Polygon)
+def draw_polygon(surface, element, view):
+    int_points = view.points(element.points)
+    # gfxdraw scans every row of the polygon however little of it is in the clip, which
+    # dominates at high zoom; clip it first, with a border so the new edges stay out of view
+    clip = surface.get_clip().inflate(4, 4)
+    xs = [x for x, _ in int_points]
+    ys = [y for _, y in int_points]
+    if min(xs) < clip.left or max(xs) > clip.right or min(ys) < clip.top or max(ys) > clip.bottom:
+        int_points = clip_polygon(int_points, clip)
+        if len(int_points) < 3:
+            return
+    pygame.gfxdraw.filled_polygon(surface, int_points, element.color)
+    pygame.gfxdraw.aapolygon(surface, int_points, element.color)
+
+
+@register_renderer(Curve)
+@register_renderer(SmoothCurve)
+def draw_curve(surface, element, view):
+    if len(element.points) > 1:
+        pygame.draw.lines(surface, element.color, False, view.points(element.points), view.length(element.thickness))
+
+
+@register_renderer(Line)
+def draw_line(surface, element, view):
+    start = view.point(element.x1, element.y1)
+    end = view.point(element.x2, element.y2)
+    pygame.draw.line(surface, element.color, start, end, view.length(element.thickness))
+
+
+def render_ring_sprite(r, color, alpha, area=None):
+    if area is None:
+        area = pygame.Rect(0, 0, r * 2 + 4, r * 2 + 4)
+    temp_surface = pygame.Surface(area.size, pygame.SRCALPHA)
+    cx, cy = r + 2 - area.x, r + 2 - area.y
+    # gfxdraw walks the whole circle, so skip the rim when it misses a partial area
+    near = math.hypot(max(0, -cx, cx - area.width), max(0, -cy, cy - area.height))
+    far = math.hypot(max(cx, area.width - cx), max(cy, area.height - cy))
+    if far <= r - 1:
+        temp_surface.fill((*color, int(alpha // 4)))
+        return temp_surface
+    pygame.gfxdraw.filled_circle(temp_surface, cx, cy, r + 2, (*color, int(alpha // 4)))
+    if near <= r + 1:
+        pygame.gfxdraw.aacircle(temp_surface, cx, cy, r, (*color, int(alpha)))
+    return temp_surface
+
+
+def render_radial_gradient(radius, color, alpha, area=None):
+    """Circle whose alpha ramps from 0 at the center to alpha at the rim.
+
+    The whole falloff is computed in one NumPy pass and written through
+    surfarray, so the cost no longer depends on a per-ring Python loop and
+    the result is the same at every radius. area restricts rendering to
+    that part of the sprite.
+    """
+    radius = max(1, radius)
+    size = radius * 2 + 4
+    if area is None:
+        area = pygame.Rect(0, 0, size, size)
+    dx = np.arange(area.left, area.right) - (radius + 2)
+    dy = np.arange(area.top, area.bottom) - (radius + 2)
+    distance = np.hypot(dx[:, None], dy[None, :])
+    ramp = np.minimum(distance / radius, 1.0) * alpha
+    # Anti-alias the rim over one pixel
+    coverage = np.clip(radius + 0.5 - distance, 0.0, 1.0)
+    sprite = pygame.Surface(area.size, pygame.SRCALPHA)
+    sprite.fill((*color, 0))
+    pygame.surfarray.pixels_alpha(sprite)[...] = (ramp * coverage).astype(np.uint8)
+    return sprite
+
+
+def render_rotated_rect_sprite(w, h, color, degrees):
+    temp_surface = pygame.Surface((w, h), pygame.SRCALPHA)
+    pygame.draw.rect(temp_surface, color, (0, 0, w, h))
+    return pygame.transform.rotate(temp_surface, degrees)
+
+
+def blit_sprite(surface, pos, size, key, build, *args):
+    """Blit the sprite build(*args) renders at pos, going through the sprite cache.
+
+    Sprites over MAX_SPRITE_BYTES (huge elements in a high-resolution export)
+    skip the cache and only the part overlapping surface is rasterized, with
+    build(*args, area=...), so memory is bounded by the target. The same
+    happens on a cache miss when little of the sprite is visible, such as
+    the strip a pan exposes.
+    """
+    cacheable = size[0] * size[1] * 4 <= MAX_SPRITE_BYTES
+    sprite = sprite_cache.get(key) if cacheable else None
+    if sprite is not None:
+        surface.blit(sprite, pos)
+        return
+    area = pygame.Rect(pos, size).clip(surface.get_clip())
+    if cacheable and area.width * area.height >= size[0] * size[1] * PARTIAL_SPRITE_FRACTION:
+        sprite = build(*args)
+        sprite_cache.put(key, sprite)
+        surface.blit(sprite, pos)
+    elif area:
+        surface.blit(build(*args, area=area.move(-pos[0], -pos[1])), area.topleft)
+
+
+@register_renderer(Ring)
+def draw_ring(surface, element, view):
+    x, y = view.point(element.x, element.y)
+    r = view.length(element.radius)
+    blit_sprite(surface, (x - r - 2, y - r - 2), (r * 2 + 4, r * 2 + 4), ("ring", r, element.color, int(element.alpha)),
+                render_ring_sprite, r, element.color, element.alpha)
+
+
+@register_renderer(CircleFade)
+def draw_circle_fade(surface, element, view):
+    x, y = view.point(element.x, element.y)
+    s = view.length(element.size)
+    blit_sprite(surface, (x - s - 2, y - s - 2), (s * 2 + 4, s * 2 + 4), ("circle_fade", s, element.color, int(element.alpha)),
+                render_radial_gradient, s, element.color, element.alpha)
+
+
+@register_renderer(RotatedRect)
+def draw_rotated_rect(surface, element, view):
+    x, y = view.point(element.x, element.y)
+    w, h = view.length(element.width), view.length(element.height)
+    steps = round(float(element.rotation) * 180 / math.pi / ROTATION_STEP)
+    degrees = (steps * ROTATION_STEP) % 360
+    c, s = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    if (w * abs(c) + h * abs(s)) * (w * abs(s) + h * abs(c)) * 4 > MAX_SPRITE_BYTES:
+        # Too big to cache, so fill the rotated outline directly (counter-clockwise, like transform.rotate)
+        corners = [(x + dx * c + dy * s, y - dx * s + dy * c)
+                   for dx, dy in ((-w / 2, -h / 2), (w / 2, -h / 2), (w / 2, h / 2), (-w / 2, h / 2))]
+        pygame.draw.polygon(surface, element.color, corners)
+        return
+    rotated = sprite_cache.fetch(("rotated_rect", w, h, element.color, degrees),
+                                 render_rotated_rect_sprite, w, h, element.color, degrees)
+    surface.blit(rotated, (x - rotated.get_width() // 2, y - rotated.get_height() // 2))
+
+
+def render_particle_sprite(size, color, antialias):
+    """A circle of radius size, antialiased on alpha or as an RLE colorkey sprite (faster to blit)"""
+    if antialias:
+        sprite = pygame.Surface((size * 2 + 3, size * 2 + 3), pygame.SRCALPHA)
+        pygame.gfxdraw.filled_circle(sprite, size + 1, size + 1, size, color)
+        pygame.gfxdraw.aacircle(sprite, size + 1, size + 1, size, color)
+    else:
+        sprite = pygame.Surface((size * 2 + 3, size * 2 + 3))
+        sprite.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        pygame.gfxdraw.filled_circle(sprite, size + 1, size + 1, size, color)
+    return sprite
+
+
+class ParticleSystem:
+    """Particles kept as contiguous NumPy arrays and updated in one vectorized step.
+
+    Positions and velocities are normalized like element coordinates; sizes
+    are radii in reference-canvas pixels, scaled by the view when drawn.
+    """
+
+    def __init__(self, count, palette, rng=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        self.palette = palette
+        self.x = rng.integers(0, SCENE_WIDTH + 1, count) / SCENE_WIDTH
+        self.y = rng.integers(0, SCENE_HEIGHT + 1, count) / SCENE_HEIGHT
+        self.size = rng.integers(5, 16, count)
+        self.color_index = rng.integers(0, len(palette), count)
+        speed = rng.uniform(0.02, 0.1, count)
+        direction = rng.uniform(0, 2 * math.pi, count)
+        self.vx = speed * np.cos(direction) * 10 / SCENE_WIDTH
+        self.vy = speed * np.sin(direction) * 10 / SCENE_HEIGHT
+        # Pixel radii, sprite keys (radius * len(palette) + color_index) and the view height they were computed for
+        self.radius = None
+        self.sprite_keys = None
+        self.sprite_height = None
+
+    # Per-particle record layout in scene files
+    dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("vx", "<f8"), ("vy", "<f8"), ("size", "u1"),
+                      ("color_index", "u1")])
+
+    def __len__(self):
+        return len(self.x)
+
+    def state(self):
+        """Return positions, velocities, sizes and colors as one structured array"""
+        state = np.empty(len(self), self.dtype)
+        for name in self.dtype.names:
+            state[name] = getattr(self, name)
+        return state
+
+    @classmethod
+    def from_state(cls, palette, state):
+        """Rebuild a particle system from a state() array (copied, so it may be memory-mapped)"""
+        particles = cls(0, palette)
+        for name in cls.dtype.names:
+            setattr(particles, name, state[name].astype(getattr(particles, name).dtype))
+        return particles
+
+    def update(self, dt=FRAME_TIME):
+        steps = dt * ANIMATION_FPS
+        self.x += self.vx * steps
+        self.y += self.vy * steps
+
+        # Bounce off edges. The direction is set, not flipped: with a variable dt, a particle that
+        # overshot in a long step could still be outside after a shorter one and flip back out. Only the
+        # few particles that crossed an edge are touched, and their overshoot is reflected back inside
+        # (clamped, in case a step crossed the whole canvas)
+        for position, velocity in ((self.x, self.vx), (self.y, self.vy)):
+            low = np.flatnonzero(position < 0)
+            velocity[low] = np.abs(velocity[low])
+            position[low] = np.minimum(-position[low], 1)
+            high = np.flatnonzero(position > 1)
+            velocity[high] = -np.abs(velocity[high])
+            position[high] = np.maximum(2 - position[high], 0)
+
+    def get_sprite(self, size, color_index):
+        # One pre-rendered sprite per (size, color) lets every particle be drawn with a blit. They live in the
+        # sprite cache, so zooming through many sizes stays within its byte budget
+        color = self.palette[color_index]
+        antialias = len(self) <= MAX_AA_PARTICLES
+        return sprite_cache.fetch(("particle", size, color, antialias), render_particle_sprite, size, color, antialias)
+
+    def draw(self, surface, view, with_rects=True):
+        """Draw all particles in a single batched blit, returning their rects"""
+        if not len(self):
+            return []
+        if self.sprite_keys is None or self.sprite_height != view.height:
+            # Sizes and colors never change, so radii and sprite keys are only recomputed on rescale
+            self.radius = np.maximum(1, np.floor(self.size * (view.height / SCENE_HEIGHT) + PIXEL_EPSILON).astype(np.intp))
+            self.sprite_keys = self.radius * len(self.palette) + self.color_index
+            self.sprite_height = view.height
+        radius, keys = self.radius, self.sprite_keys
+        left = np.floor(view.x + self.x * view.width + PIXEL_EPSILON).astype(np.intp) - radius - 1
+        top = np.floor(view.y + self.y * view.height + PIXEL_EPSILON).astype(np.intp) - radius - 1
+        diameter = radius * 2 + 3
+        # Cull particles outside the surface in one vectorized test, so a zoomed-in view only blits what it shows
+        width, height = surface.get_size()
+        visible = (left < width) & (top < height) & (left + diameter > 0) & (top + diameter > 0)
+        if not visible.all():
+            left, top, diameter, radius, keys = (values[visible] for values in (left, top, diameter, radius, keys))
+
+        # Look up sprites only for the sizes on screen; those over MAX_SPRITE_BYTES are drawn directly
+        sprites = np.empty(int(keys.max()) + 1 if len(keys) else 0, object)
+        uncached = []
+        for key in np.flatnonzero(np.bincount(keys, minlength=len(sprites))).tolist():
+            size, color_index = divmod(key, len(self.palette))
+            if (size * 2 + 3) ** 2 * 4 <= MAX_SPRITE_BYTES:
+                sprites[key] = self.get_sprite(size, color_index)
+            else:
+                uncached.append(key)
+        blitted = np.ones(len(keys), bool)
+        if uncached:
+            blitted = ~np.isin(keys, uncached)
+            antialias = len(self) <= MAX_AA_PARTICLES
+            for l, t, r, key in zip(*(values[~blitted].tolist() for values in (left, top, radius, keys))):
+                color = self.palette[key % len(self.palette)]
+                pygame.gfxdraw.filled_circle(surface, l + r + 1, t + r + 1, r, color)
+                if antialias:
+                    pygame.gfxdraw.aacircle(surface, l + r + 1, t + r + 1, r, color)
+        surface.blits(zip(sprites[keys[blitted]].tolist(), zip(left[blitted].tolist(), top[blitted].tolist())),
+                      doreturn=False)
+
+        if not with_rects:
+            return []
+        return [pygame.Rect(l, t, d, d) for l, t, d in zip(left.tolist(), top.tolist(), diameter.tolist())]
+
+
+class SpatialGrid:
+    """Uniform grid over element bounding boxes, for finding what a viewport shows.
+
+    Each element is listed in every cell its box overlaps, all in one
+    cell-sorted array. Boxes spanning more than GRID_MAX_CELLS cells
+    (canvas-wide lines) are kept apart and tested directly, so the grid
+    stays proportional to the number of elements.
+    """
+
+    def __init__(self, bounds, cells=GRID_CELLS):
+        self.cells = cells
+        self.bounds = np.asarray(bounds, np.float64).reshape(-1, 4)
+        low = np.clip(np.floor(self.bounds[:, :2] * cells), 0, cells - 1).astype(np.intp)
+        high = np.clip(np.floor(self.bounds[:, 2:] * cells), 0, cells - 1).astype(np.intp)
+        spans = high - low + 1
+        covered = spans[:, 0] * spans[:, 1]
+        large = covered > GRID_MAX_CELLS
+        self.large = np.flatnonzero(large)
+
+        # One (cell, element) entry per cell each remaining box overlaps
+        small = np.flatnonzero(~large)
+        counts = covered[small]
+        element = np.repeat(small, counts)
+        offset = np.arange(len(element)) - np.repeat(np.cumsum(counts) - counts, counts)
+        column = low[element, 0] + offset % spans[element, 0]
+        row = low[element, 1] + offset // spans[element, 0]
+        cell = row * cells + column
+        order = np.argsort(cell, kind="stable")
+        self.entries = element[order]
+        self.starts = np.searchsorted(cell[order], np.arange(cells * cells + 1))
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def query(self, left, top, right, bottom):
+        """Indices, in draw order, of the elements whose boxes overlap the rectangle"""
+        cells = self.cells
+        x0, y0 = (min(cells - 1, max(0, math.floor(value * cells))) for value in (left, top))
+        x1, y1 = (min(cells - 1, max(0, math.floor(value * cells))) for value in (right, bottom))
+        # The cells of one grid row are contiguous in entries
+        hits = [self.entries[self.starts[start + x0]:self.starts[start + x1 + 1]]
+                for start in range(y0 * cells, (y1 + 1) * cells, cells)]
+        hits.append(self.large)
+        candidates = np.unique(np.concatenate(hits))
+        boxes = self.bounds[candidates]
+        overlap = (boxes[:, 0] <= right) & (boxes[:, 2] >= left) & (boxes[:, 1] <= bottom) & (boxes[:, 3] >= top)
+        return candidates[overlap]
+
+
+def surface_rgb(surface):
+    """Return the pixels of surface as a (height, width, 3) RGB24 array.
+
+    Gathers the channels of a 32-bit surface with NumPy, about 2.5x faster
+    than pygame.image.tostring(surface, "RGB") at 1080p.
+    """
+    if surface.get_bytesize() != 4 or sys.byteorder != "little":
+        width, height = surface.get_size()
+        return np.frombuffer(pygame.image.tostring(surface, "RGB"), np.uint8).reshape(height, width, 3)
+    width, height = surface.get_size()
+    pixels = pygame.surfarray.pixels2d(surface).T.view(np.uint8).reshape(height, width, 4)
+    rgb = np.empty((height, width, 3), np.uint8)
+    for channel, shift in enumerate(surface.get_shifts()[:3]):
+        rgb[..., channel] = pixels[..., shift // 8]
+    return rgb
+
+
+def png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+
+def write_png(file, width, height, row_blocks, compression=PNG_COMPRESSION):
+    """Stream 8-bit RGB rows into a PNG file.
+
+    row_blocks yields bytes-like blocks of whole rows; each block is filtered
+    and compressed as it arrives, so only one block is held at a time.
+    """
+    file.write(b"\x89PNG\r\n\x1a\n")
+    file.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+    compressor = zlib.compressobj(compression)
+    stride = width * 3
+    for block in row_blocks:
+        rows = np.frombuffer(block, np.uint8).reshape(-1, stride)
+        # Every scanline starts with its filter type (0 = none)
+        filtered = np.zeros((rows.shape[0], stride + 1), np.uint8)
+        filtered[:, 1:] = rows
+        data = compressor.compress(filtered)
+        if data:
+            file.write(png_chunk(b"IDAT", data))
+    file.write(png_chunk(b"IDAT", compressor.flush()))
+    file.write(png_chunk(b"IEND", b""))
+
+
+def save_png(surface, filename, compression=PNG_COMPRESSION):
+    """Save surface as a PNG with the given zlib compression level"""
+    width, height = surface.get_size()
+    with open(filename, "wb") as file:
+        write_png(file, width, height, [surface_rgb(surface)], compression)
+
+
+class PngExporter:
+    """Encodes and writes PNGs on a background thread fed by a bounded queue"""
+
+    def __init__(self, compression=PNG_COMPRESSION, max_pending=EXPORT_QUEUE_SIZE, notify=None):
+        self.compression = compression
+        # Called from the writer thread after each export finishes
+        self.notify = notify
+        self.pending = queue.Queue(max_pending)
+        self.completed = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="png-exporter", daemon=True)
+        self.thread.start()
+
+    def submit(self, filename, surface):
+        """Queue surface for export, or return False if the writer is saturated.
+
+        The pixels are copied once here; the surface can be reused right away.
+        """
+        # Only the UI thread submits, so checking first avoids copying pixels we would drop
+        if self.pending.full():
+            return False
+        self.pending.put_nowait((filename, surface.get_size(), surface_rgb(surface)))
+        return True
+
+    def run(self):
+        while True:
+            job = self.pending.get()
+            if job is None:
+                break
+            filename, (width, height), pixels = job
+            try:
+                # zlib releases the GIL while compressing, so the UI keeps animating
+                with open(filename, "wb") as file:
+                    write_png(file, width, height, [pixels], self.compression)
+                self.completed.put((filename, None))
+            except Exception as e:
+                # Anything, not just OSError: a dead writer would refuse every later save
+                self.completed.put((filename, e))
+            if self.notify is not None:
+                self.notify()
+
+    def poll(self):
+        """Return (filename, error) for every export finished since the last poll"""
+        results = []
+        while True:
+            try:
+                results.append(self.completed.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        """Finish the queued exports and stop the writer thread"""
+        # A full queue drains as the writer works; a writer that died never drains it
+        while self.thread.is_alive():
+            try:
+                self.pending.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+
+
+class MusicPlayer:
+    """Loops one track per emotion and crossfades between them without blocking the UI.
+
+    Missing files are reported once, here. A background thread reads every
+    track into memory and decodes them into mixer.Sound objects on request
+    (SDL_mixer releases the GIL while decoding). play() starts a cached track
+    at once, otherwise the old track keeps playing until poll() receives the
+    new one from the thread.
+    """
+
+    def __init__(self, tracks=MUSIC_FILES, fade_ms=MUSIC_FADE_MS, cache_size=MUSIC_CACHE_SIZE, notify=None):
+        self.fade_ms = fade_ms
+        # Called from the loader thread after each track is decoded
+        self.notify = notify
+        self.cache_size = cache_size
+        self.tracks = {emotion: path for emotion, path in tracks.items() if os.path.exists(path)}
+        missing = [tracks[emotion] for emotion in tracks if emotion not in self.tracks]
+        if missing:
+            print(f"Music files not found, those emotions will be silent: {', '.join(missing)}")
+        # Decoded sounds, least recently used first
+        self.sounds = OrderedDict()
+        self.loading = set()
+        self.wanted = None
+        self.sound = None
+        self.channel = None
+        self.requests = queue.Queue()
+        self.completed = queue.Queue()
+        self.thread = None
+        if mixer.get_init() and self.tracks:
+            self.thread = threading.Thread(target=self.run, name="music-loader", daemon=True)
+            self.thread.start()
+
+    def play(self, emotion):
+        """Crossfade to emotion's track, or fade out if it has none"""
+        if emotion == self.wanted:
+            return
+        self.wanted = emotion
+        sound = self.sounds.get(emotion)
+        if sound is not None:
+            self.sounds.move_to_end(emotion)
+            self.start(sound)
+        elif emotion in self.tracks and self.thread is not None:
+            if emotion not in self.loading:
+                self.loading.add(emotion)
+                self.requests.put(emotion)
+        else:
+            self.fade_out()
+
+    def stop(self):
+        self.wanted = None
+        self.fade_out()
+
+    def start(self, sound):
+        if sound is self.sound:
+            return
+        self.fade_out()
+        self.sound = sound
+        self.channel = sound.play(loops=-1, fade_ms=self.fade_ms)
+
+    def fade_out(self):
+        if self.channel is not None:
+            self.channel.fadeout(self.fade_ms)
+        self.channel = None
+        self.sound = None
+
+    def run(self):
+        # Prefetch every file while idle, but serve decode requests first
+        # A private copy: poll() drops failed tracks from self.tracks on the UI thread
+        paths = dict(self.tracks)
+        unread = list(paths)
+        data = {}
+        while True:
+            prefetch = False
+            try:
+                emotion = self.requests.get(block=not unread)
+            except queue.Empty:
+                emotion = unread[0]
+                prefetch = True
+            if emotion is None:
+                break
+            try:
+                if emotion not in data:
+                    if emotion in unread:
+                        unread.remove(emotion)
+                    with open(paths[emotion], "rb") as file:
+                        data[emotion] = file.read()
+                if prefetch:
+                    continue
+                self.completed.put((emotion, mixer.Sound(file=io.BytesIO(data[emotion])), None))
+            except (OSError, pygame.error) as e:
+                # Reported like a decode error, whether the read was requested or a prefetch
+                self.completed.put((emotion, None, e))
+            if self.notify is not None:
+                self.notify()
+
+    def poll(self):
+        """Collect decoded tracks and start the wanted one if it arrived; call once per frame"""
+        while True:
+            try:
+                emotion, sound, error = self.completed.get_nowait()
+            except queue.Empty:
+                return
+            self.loading.discard(emotion)
+            if error is not None:
+                # Don't retry a file that can't be read or decoded; a request and a prefetch may both report it
+                if self.tracks.pop(emotion, None) is not None:
+                    print(f"Music error: {error}")
+                continue
+            self.sounds[emotion] = sound
+            while len(self.sounds) > self.cache_size:
+                self.sounds.popitem(last=False)
+            if emotion == self.wanted:
+                self.start(sound)
+
+    def close(self):
+        """Stop playback and the loader thread"""
+        self.stop()
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join()
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted sequence"""
+    if not sorted_values:
+        return 0.0
+    index = int(round(q / 100 * (len(sorted_values) - 1)))
+    return sorted_values[min(len(sorted_values) - 1, index)]
+
+
+class FrameProfiler:
+    """Per-stage frame timings with rolling p50/p95/p99 and an optional per-frame trace.
+
+    Stages are timed with mark(): each call charges the time since the
+    previous mark to the named stage. add() records extra detail timings
+    (such as per element kind) that are not part of the frame total. While
+    disabled every call returns immediately.
+    """
+
+    def __init__(self, enabled=False, window=PROFILE_WINDOW, record_trace=False, trace_frames=PROFILE_TRACE_FRAMES):
+        self.enabled = enabled
+        self.samples = {}
+        self.window = window
+        self.current = {}
+        self.frame_start = self.last = 0
+        self.frame_index = 0
+        self.record_trace = record_trace
+        # Rows carry their frame number, so a trace that dropped its oldest frames says where it starts
+        self.trace = deque(maxlen=trace_frames)
+
+    def begin_frame(self):
+        if not self.enabled:
+            return
+        self.current = {}
+        self.frame_start = self.last = time.perf_counter_ns()
+
+    def mark(self, stage):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        self.current[stage] = self.current.get(stage, 0) + now - self.last
+        self.last = now
+
+    def add(self, name, nanoseconds):
+        if not self.enabled:
+            return
+        self.current[name] = self.current.get(name, 0) + nanoseconds
+
+    def end_frame(self):
+        if not self.enabled:
+            return
+        self.current["total"] = self.last - self.frame_start
+        timings = {name: ns / 1e6 for name, ns in self.current.items()}
+        for name, ms in timings.items():
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(ms)
+        if self.record_trace:
+            self.trace.append({"frame": self.frame_index, **timings})
+        self.frame_index += 1
+
+    def summary(self):
+        """Return {stage: (p50, p95, p99)} in milliseconds over the rolling window"""
+        result = {}
+        for name, samples in self.samples.items():
+            ordered = sorted(samples)
+            result[name] = (percentile(ordered, 50), percentile(ordered, 95), percentile(ordered, 99))
+        return result
+
+    def save_trace(self, path):
+        """Write the recorded per-frame timings as CSV or JSON, chosen by file extension"""
+        if path.lower().endswith(".json"):
+            with open(path, "w") as file:
+                summary = {name: dict(zip(("p50", "p95", "p99"), values)) for name, values in self.summary().items()}
+                json.dump({"frames": list(self.trace), "summary": summary}, file, indent=1)
+            return
+        columns = ["frame"]
+        for row in self.trace:
+            columns.extend(name for name in row if name not in columns)
+        with open(path, "w", newline="") as file:
+            writer = csv.DictWriter(file, columns, restval="")
+            writer.writeheader()
+            writer.writerows(self.trace)
+
+
+def render_profile_hud(profiler):
+    """Render the profiler's percentiles into a small translucent panel"""
+    ensure_init(fonts=True)
+    lines = [f"{'stage':<16}{'p50':>7}{'p95':>7}{'p99':>7}"]
+    for name, (p50, p95, p99) in sorted(profiler.summary().items()):
+        lines.append(f"{name:<16}{p50:7.2f}{p95:7.2f}{p99:7.2f}")
+    rendered = [instr_font.render(line, True, (240, 240, 240)) for line in lines]
+    width = max(line.get_width() for line in rendered) + 16
+    height = sum(line.get_height() for line in rendered) + 12
+    hud = pygame.Surface((width, height))
+    hud.fill((25, 30, 45))
+    y = 6
+    for line in rendered:
+        hud.blit(line, (8, y))
+        y += line.get_height()
+    return hud
+
+
+def surface_bytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class RenderCache:
+    """LRU cache of rendered surfaces bounded by total pixel memory.
+
+    sizeof measures an entry in bytes; pass len to cache encoded images.
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_BYTES, sizeof=surface_bytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        surface = self.entries.get(key)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return surface
+
+    def put(self, key, surface):
+        nbytes = self.sizeof(surface)
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            old = self.entries.pop(key)
+            self.total_bytes -= self.sizeof(old)
+        self.entries[key] = surface
+        self.total_bytes += nbytes
+        # Evict least recently used renders until we are back under budget
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.total_bytes -= self.sizeof(evicted)
+
+    def fetch(self, key, build, *args):
+        """Return the surface cached under key, building it with build(*args) on a miss"""
+        surface = self.get(key)
+        if surface is None:
+            surface = build(*args)
+            self.put(key, surface)
+        return surface
+
+    def clear(self):
+        self.entries.clear()
+        self.total_bytes = 0
+
+
+# Alpha sprites shared by every scene, keyed by their quantized parameters
+sprite_cache = RenderCache(SPRITE_CACHE_BYTES)
+
+
+def element_kind(kind):
+    """Return the registered element class for a kind name from a scene file"""
+    element_class = ELEMENT_KINDS.get(kind)
+    if element_class is None:
+        raise ValueError(f"unknown element kind {kind!r}")
+    return element_class
+
+
+class SceneElements:
+    """Read-only sequence of a saved scene's elements, decoded in chunks as it is iterated.
+
+    Backed by the arrays of a (usually memory-mapped) scene file, so a scene
+    with millions of elements never exists as Python objects all at once.
+    """
+
+    def __init__(self, order, classes, records, points):
+        # Kind code of every element in draw order, indexing classes and records
+        self.order = order
+        self.classes = classes
+        self.records = records
+        self.points = points
+        # Index of each element within its kind's records, computed on first random access
+        self.positions = None
+        # The scene file and its memory map, when read_scene loaded it lazily
+        self.path = None
+        self.mapping = None
+
+    def __len__(self):
+        return len(self.order)
+
+    def __iter__(self):
+        cursors = [0] * len(self.classes)
+        for start in range(0, len(self.order), SCENE_CHUNK):
+            codes = self.order[start:start + SCENE_CHUNK]
+            # Decode the chunk's records kind by kind, then hand them out in draw order
+            decoded = []
+            for code, count in enumerate(np.bincount(codes, minlength=len(self.classes)).tolist()):
+                rows = self.records[code][cursors[code]:cursors[code] + count].tolist()
+                cursors[code] += count
+                from_record = self.classes[code].from_record
+                decoded.append(iter([from_record(row, self.points) for row in rows]))
+            for code in codes.tolist():
+                yield next(decoded[code])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("scene element index out of range")
+        if self.positions is None:
+            self.positions = np.empty(len(self.order), np.intp)
+            for code in range(len(self.classes)):
+                mask = self.order == code
+                self.positions[mask] = np.arange(np.count_nonzero(mask))
+        code = int(self.order[index])
+        return self.classes[code].from_record(self.records[code][self.positions[index]].tolist(), self.points)
+
+    def maps(self, path):
+        """Whether this sequence is backed by a memory map of the file at path"""
+        return self.mapping is not None and os.path.exists(path) and os.path.samefile(self.path, path)
+
+    def close(self):
+        """Unmap the backing file, leaving an empty sequence"""
+        self.order = np.empty(0, np.uint8)
+        self.records = [np.empty(0, element_class.dtype) for element_class in self.classes]
+        self.points = np.empty((0, 2))
+        self.positions = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+def write_scene(path, scene):
+    """Write a scene dict (emotion, seed, bg_color, elements, particles) to path.
+
+    The binary layout is SCENE_MAGIC, a little-endian u32 version and u32
+    header length, a JSON header padded to 8 bytes, then 8-byte aligned
+    sections: one kind code per element in draw order, one packed record
+    array per element kind, the shared (n, 2) vertex array and the particle
+    state. The header lists the kinds and each section's offset and count.
+    A path ending in .json gets a readable debug form of the same scene.
+
+    Windows can't replace a file that is still memory-mapped, so a lazily
+    loaded scene must be closed before it is saved over; a PermissionError
+    is raised otherwise. EmotionArtGenerator.save_scene does this itself.
+    """
+    particles = scene["particles"]
+    if path.endswith(".json"):
+        data = {
+            "format": SCENE_MAGIC.decode(),
+            "version": SCENE_VERSION,
+            "emotion": scene["emotion"],
+            "seed": scene["seed"],
+            "bg_color": list(scene["bg_color"]),
+            "elements": [element.to_json() for element in scene["elements"]],
+            "particles": None if particles is None else {name: particles[name].tolist() for name in particles.dtype.names},
+        }
+        payload = json.dumps(data, indent=1).encode()
+    else:
+        elements = scene["elements"]
+        codes = {}
+        records = []
+        points = []
+        order = np.empty(len(elements), np.uint8)
+        for index, element in enumerate(elements):
+            code = codes.get(type(element))
+            if code is None:
+                code = codes[type(element)] = len(records)
+                records.append([])
+            order[index] = code
+            records[code].append(element.to_record(points))
+
+        sections = [("order", order)]
+        sections += [(element_class.kind, np.array(records[code], element_class.dtype))
+                     for element_class, code in codes.items()]
+        sections.append(("points", np.array(points, "<f8").reshape(-1, 2)))
+        if particles is not None:
+            sections.append(("particles", particles))
+        offsets = {}
+        offset = 0
+        for name, array in sections:
+            offsets[name] = [offset, len(array)]
+            offset += -(-array.nbytes // 8) * 8
+        header = json.dumps({
+            "emotion": scene["emotion"],
+            "seed": scene["seed"],
+            "bg_color": list(scene["bg_color"]),
+            "kinds": [element_class.kind for element_class in codes],
+            "sections": offsets,
+        }).encode()
+        header += b" " * (-len(header) % 8)
+
+        payload = bytearray(SCENE_MAGIC + struct.pack("<II", SCENE_VERSION, len(header)) + header)
+        for name, array in sections:
+            payload += array.tobytes()
+            payload += bytes(-len(payload) % 8)
+
+    # Write a temporary file and swap it in, so a failed save never leaves a truncated scene behind
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(payload)
+    try:
+        os.replace(temporary, path)
+    except OSError:
+        os.remove(temporary)
+        raise
+
+
+def read_scene(path, lazy=True):
+    """Read a scene written by write_scene and return it as a dict.
+
+    With lazy, a binary scene is memory-mapped and its elements come back as
+    a SceneElements sequence decoded while rendering; otherwise they are all
+    decoded into a list up front.
+    """
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("format") != SCENE_MAGIC.decode():
+            raise ValueError(f"{path} is not a scene file")
+        if data["version"] > SCENE_VERSION:
+            raise ValueError(f"{path} uses scene format version {data['version']}, newer than {SCENE_VERSION}")
+        particles = None
+        if data["particles"] is not None:
+            state = data["particles"]
+            particles = np.empty(len(state["x"]), ParticleSystem.dtype)
+            for name in particles.dtype.names:
+                particles[name] = state[name]
+        elements = [element_kind(record["kind"]).from_json(record) for record in data["elements"]]
+        return {"emotion": data["emotion"], "seed": data["seed"], "bg_color": tuple(data["bg_color"]),
+                "elements": elements, "particles": particles}
+
+    with open(path, "rb") as file:
+        data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if lazy else file.read()
+    if data[:len(SCENE_MAGIC)] != SCENE_MAGIC:
+        raise ValueError(f"{path} is not a scene file")
+    version, header_length = struct.unpack_from("<II", data, len(SCENE_MAGIC))
+    if version > SCENE_VERSION:
+        raise ValueError(f"{path} uses scene format version {version}, newer than {SCENE_VERSION}")
+    start = len(SCENE_MAGIC) + 8
+    header = json.loads(bytes(data[start:start + header_length]))
+    base = start + header_length
+
+    def section(name, dtype):
+        offset, count = header["sections"][name]
+        return np.frombuffer(data, dtype, count, base + offset)
+
+    classes = [element_kind(kind) for kind in header["kinds"]]
+    records = [section(element_class.kind, element_class.dtype) for element_class in classes]
+    points = section("points", np.dtype(("<f8", 2)))
+    elements = SceneElements(section("order", np.uint8), classes, records, points)
+    if lazy:
+        elements.path = path
+        elements.mapping = data
+    else:
+        elements = list(elements)
+    particles = section("particles", ParticleSystem.dtype) if "particles" in header["sections"] else None
+    return {"emotion": header["emotion"], "seed": header["seed"], "bg_color": tuple(header["bg_color"]),
+            "elements": elements, "particles": particles}
 
 
 class EmotionArtGenerator:
-    def __init__(self):
+    def __init__(self, particle_count=PARTICLE_COUNT, render_cache_bytes=RENDER_CACHE_BYTES, density=1.0):
         self.current_emotion = None
+        # Multiplier applied to the number of elements each scene generates
+        self.density = density
+        self.seed = None
+        self.rng = np.random.default_rng()
         self.art_elements = []
+        self.particles = None
+        self.particle_count = particle_count
+        # Static layers keyed by (*scene_key, size); the same seed always yields the same art
+        self.render_cache = RenderCache(render_cache_bytes)
+        # Optional FrameProfiler that receives per-element-kind draw timings
+        self.profiler = None
         self.bg_color = WHITE
         self.music_enabled = False
         self.save_count = 0
-
-    def generate_art(self, emotion):
+        self.static_layer = None
+        self.animated_rects = []
+        # (layer, view) of a static layer left behind by a pan, to be scrolled rather than rebuilt
+        self.scrolled_layer = None
+        # Identifies the scene in render cache keys: (emotion, seed) for generated scenes
+        self.scene_key = None
+        # Navigation: magnification and the scene point shown in the middle of the art area
+        self.zoom = 1.0
+        self.center = (0.5, 0.5)
+        # SpatialGrid over art_elements, built on first use, the list it was built from and the
+        # thickest line or curve in it (in scene units)
+        self.spatial_index = None
+        self.indexed_elements = None
+        self.max_thickness = 0
+
+    def generate_art(self, emotion, seed=None):
+        """Generate the scene for emotion from a 64-bit seed (a fresh random one if omitted)"""
+        if seed is None:
+            seed = random.getrandbits(64)
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
         self.current_emotion = emotion
+        self.scene_key = (emotion, seed)
         self.art_elements = []
+        self.particles = None
         self.bg_color = self.get_background_color(emotion)
-
-        # Generate different art elements based on emotion
-        if emotion == "Happy":
-            self.generate_happy_art()
-        elif emotion == "Sad":
-            self.generate_sad_art()
-        elif emotion == "Angry":
-            self.generate_angry_art()
-        elif emotion == "Calm":
-            self.generate_calm_art()
-        elif emotion == "Excited":
-            self.generate_excited_art()
+        self.invalidate_scene()
+
+        # Elements never form reference cycles, so keep the cycle collector from
+        # rescanning the growing scene over and over while it is built
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            # Generate different art elements based on emotion
+            if emotion == "Happy":
+                self.generate_happy_art()
+            elif emotion == "Sad":
+                self.generate_sad_art()
+            elif emotion == "Angry":
+                self.generate_angry_art()
+            elif emotion == "Calm":
+                self.generate_calm_art()
+            elif emotion == "Excited":
+                self.generate_excited_art()
+        finally:
+            if collecting:
+                gc.enable()
+
+    def save_scene(self, path):
+        """Save the current scene description; a path ending in .json gets the readable debug form.
+
+        A lazily loaded scene saved over its own file is decoded and closed
+        first, as write_scene requires, then mapped again from the new file.
+        """
+        elements = self.art_elements
+        remap = isinstance(elements, SceneElements) and elements.maps(path)
+        if remap:
+            self.art_elements = list(elements)
+            elements.close()
+            elements = self.art_elements
+        write_scene(path, {
+            "emotion": self.current_emotion,
+            "seed": self.seed,
+            "bg_color": self.bg_color,
+            "elements": elements,
+            "particles": None if self.particles is None else self.particles.state(),
+        })
+        if remap:
+            self.load_scene(path)
+
+    def load_scene(self, path, lazy=True):
+        """Replace the current scene with one saved by save_scene.
+
+        With lazy, a binary scene is memory-mapped and its elements are
+        decoded while rendering instead of all at load time.
+        """
+        scene = read_scene(path, lazy)
+        self.current_emotion = scene["emotion"]
+        self.seed = scene["seed"]
+        # A scene file may have been edited, so it never shares cached layers with its seed
+        self.scene_key = ("scene", os.path.abspath(path), os.stat(path).st_mtime_ns)
+        self.bg_color = scene["bg_color"]
+        self.art_elements = scene["elements"]
+        self.particles = None
+        if scene["particles"] is not None:
+            self.particles = ParticleSystem.from_state(EMOTION_PALETTES[self.current_emotion], scene["particles"])
+        self.invalidate_scene()
+
+    def scaled(self, count):
+        """Scale a per-scene element count by the generator's density"""
+        return max(1, round(count * self.density)) if count else 0
 
     def get_background_color(self, emotion):
         # Return a light version of the first color in the palette
         base_color = EMOTION_PALETTES[emotion][0]
         return tuple(min(255, c + 100) for c in base_color)
 
+    def randint(self, low, high, size):
+        """Integers in [low, high] like random.randint, drawn as one array of shape size"""
+        return self.rng.integers(low, high + 1, size)
+
+    def colors(self, emotion, count):
+        """count colors picked at random from the emotion's palette"""
+        palette = EMOTION_PALETTES[emotion]
+        return [palette[index] for index in self.rng.integers(0, len(palette), count).tolist()]
+
+    # Each generator draws every parameter of a group of elements as one array
+    # and only then builds the elements, instead of one random call at a time
+
     def generate_happy_art(self):
         # Bright, bubbly elements
-        for _ in range(15):
-            x = random.randint(50, WIDTH - 50)
-            y = random.randint(50, HEIGHT - 50)
-            size = random.randint(20, 80)
-            color = random.choice(EMOTION_PALETTES["Happy"])
-            self.art_elements.append(("circle", x, y, size, color))
-
-        for _ in range(10):
-            points = []
-            for _ in range(5):
-                x = random.randint(100, WIDTH - 100)
-                y = random.randint(100, HEIGHT - 100)
-                points.append((x, y))
-            color = random.choice(EMOTION_PALETTES["Happy"])
-            self.art_elements.append(("polygon", points, color))
+        count = self.scaled(15)
+        x, y = scene_point(self.randint(50, SCENE_WIDTH - 50, count), self.randint(50, SCENE_HEIGHT - 50, count))
+        size = scene_length(self.randint(20, 80, count))
+        self.art_elements.extend(map(Circle, x.tolist(), y.tolist(), size.tolist(), self.colors("Happy", count)))
+
+        count = self.scaled(10)
+        x, y = scene_point(self.randint(100, SCENE_WIDTH - 100, (count, 5)), self.randint(100, SCENE_HEIGHT - 100, (count, 5)))
+        self.art_elements.extend(map(Polygon, point_rows(x, y), self.colors("Happy", count)))
 
     def generate_sad_art(self):
         # Flowing, melancholic elements
-        for _ in range(8):
-            start_x = random.randint(100, WIDTH - 100)
-            start_y = random.randint(100, HEIGHT - 100)
-            length = random.randint(100, 300)
-            thickness = random.randint(2, 8)
-            color = random.choice(EMOTION_PALETTES["Sad"])
-            segments = []
-
-            for i in range(20):
-                seg_x = start_x + (length / 20) * i
-                seg_y = start_y + random.randint(-30, 30)
-                segments.append((seg_x, seg_y))
-
-            self.art_elements.append(("curve", segments, thickness, color))
+        count = self.scaled(8)
+        start_x = self.randint(100, SCENE_WIDTH - 100, (count, 1))
+        start_y = self.randint(100, SCENE_HEIGHT - 100, (count, 1))
+        length = self.randint(100, 300, (count, 1))
+        thickness = scene_length(self.randint(2, 8, count))
+        colors = self.colors("Sad", count)
+        # 20 segments per curve, each wandering up to 30px off the starting height
+        x, y = scene_point(start_x + (length / 20) * np.arange(20), start_y + self.randint(-30, 30, (count, 20)))
+        self.art_elements.extend(map(Curve, point_rows(x, y), thickness.tolist(), colors))
 
     def generate_angry_art(self):
         # Sharp, jagged elements
-        for _ in range(12):
-            center_x = random.randint(100, WIDTH - 100)
-            center_y = random.randint(100, HEIGHT - 100)
-            size = random.randint(30, 100)
-            points = []
-            spikes = random.randint(3, 8)
-
-            for i in range(spikes * 2):
-                angle = (i * math.pi / spikes) + random.uniform(-0.2, 0.2)
-                radius = size if i % 2 == 0 else size * 0.5
-                x = center_x + radius * math.cos(angle)
-                y = center_y + radius * math.sin(angle)
-                points.append((x, y))
-
-            color = random.choice(EMOTION_PALETTES["Angry"])
-            self.art_elements.append(("polygon", points, color))
-
-        for _ in range(15):
-            x1 = random.randint(0, WIDTH)
-            y1 = random.randint(0, HEIGHT)
-            x2 = random.randint(0, WIDTH)
-            y2 = random.randint(0, HEIGHT)
-            thickness = random.randint(1, 5)
-            color = random.choice(EMOTION_PALETTES["Angry"])
-            self.art_elements.append(("line", x1, y1, x2, y2, thickness, color))
+        count = self.scaled(12)
+        center_x = self.randint(100, SCENE_WIDTH - 100, (count, 1))
+        center_y = self.randint(100, SCENE_HEIGHT - 100, (count, 1))
+        size = self.randint(30, 100, (count, 1))
+        spikes = self.randint(3, 8, (count, 1))
+        # Stars alternate outer and inner vertices; every row has room for the most
+        # spikes and is cut to its own length
+        i = np.arange(2 * 8)
+        angle = i * math.pi / spikes + self.rng.uniform(-0.2, 0.2, (count, 2 * 8))
+        radius = np.where(i % 2 == 0, size, size * 0.5)
+        x, y = scene_point(center_x + radius * np.cos(angle), center_y + radius * np.sin(angle))
+        colors = self.colors("Angry", count)
+        self.art_elements.extend(map(Polygon, point_rows(x, y, spikes * 2), colors))
+
+        count = self.scaled(15)
+        x1, y1 = scene_point(self.randint(0, SCENE_WIDTH, count), self.randint(0, SCENE_HEIGHT, count))
+        x2, y2 = scene_point(self.randint(0, SCENE_WIDTH, count), self.randint(0, SCENE_HEIGHT, count))
+        thickness = scene_length(self.randint(1, 5, count))
+        colors = self.colors("Angry", count)
+        self.art_elements.extend(map(Line, x1.tolist(), y1.tolist(), x2.tolist(), y2.tolist(), thickness.tolist(), colors))
 
     def generate_calm_art(self):
         # Smooth, flowing elements with improved visuals
         # Add gentle ripple effect
-        for _ in range(4):
-            center_x = random.randint(100, WIDTH - 100)
-            center_y = random.randint(100, HEIGHT - 100)
-            max_radius = random.randint(60, 180)
-            rings = random.randint(4, 7)
-
-            for i in range(rings):
-                radius = max_radius * (i + 1) / rings
-                color = random.choice(EMOTION_PALETTES["Calm"])
-                alpha = int(255 * (1 - (i / rings) * 0.7))  # Fade out effect
-                self.art_elements.append(("ring", center_x, center_y, radius, color, alpha))
+        count = self.scaled(4)
+        center_x, center_y = scene_point(self.randint(100, SCENE_WIDTH - 100, count),
+                                         self.randint(100, SCENE_HEIGHT - 100, count))
+        max_radius = self.randint(60, 180, count)
+        rings = self.randint(4, 7, count)
+        # One entry per ring: the ripple it belongs to and its index i within it
+        ripple = np.repeat(np.arange(count), rings)
+        i = np.arange(len(ripple)) - np.repeat(np.cumsum(rings) - rings, rings)
+        radius = scene_length(max_radius[ripple] * (i + 1) / rings[ripple])
+        colors = self.colors("Calm", len(ripple))
+        alpha = (255 * (1 - (i / rings[ripple]) * 0.7)).astype(int)  # Fade out effect
+        self.art_elements.extend(map(Ring, center_x[ripple].tolist(), center_y[ripple].tolist(), radius.tolist(),
+                                     colors, alpha.tolist()))
 
         # Add flowing curves
-        for _ in range(6):
-            points = []
-            length = random.randint(200, 400)
-            start_x = random.randint(50, WIDTH - 50)
-            start_y = random.randint(50, HEIGHT - 50)
-            amplitude = random.randint(20, 40)
-            frequency = random.uniform(0.2, 0.4)
-
-            for i in range(30):
-                progress = i / 29
-                x = start_x + length * progress
-                y = start_y + amplitude * math.sin(progress * math.pi * frequency * 10)
-                points.append((x, y))
-
-            color = random.choice(EMOTION_PALETTES["Calm"])
-            thickness = random.randint(3, 8)
-            self.art_elements.append(("smooth_curve", points, thickness, color))
-            
+        count = self.scaled(6)
+        length = self.randint(200, 400, (count, 1))
+        start_x = self.randint(50, SCENE_WIDTH - 50, (count, 1))
+        start_y = self.randint(50, SCENE_HEIGHT - 50, (count, 1))
+        amplitude = self.randint(20, 40, (count, 1))
+        frequency = self.rng.uniform(0.2, 0.4, (count, 1))
+        progress = np.arange(30) / 29
+        x, y = scene_point(start_x + length * progress,
+                           start_y + amplitude * np.sin(progress * math.pi * frequency * 10))
+        colors = self.colors("Calm", count)
+        thickness = scene_length(self.randint(3, 8, count))
+        self.art_elements.extend(map(SmoothCurve, point_rows(x, y), thickness.tolist(), colors))
+
         # Add floating circles for added serenity
-        for _ in range(10):
-            x = random.randint(50, WIDTH - 50)
-            y = random.randint(50, HEIGHT - 50)
-            size = random.randint(10, 25)
-            color = random.choice(EMOTION_PALETTES["Calm"])
-            alpha = random.randint(100, 180)
-            self.art_elements.append(("circle_fade", x, y, size, color, alpha))
+        count = self.scaled(10)
+        x, y = scene_point(self.randint(50, SCENE_WIDTH - 50, count), self.randint(50, SCENE_HEIGHT - 50, count))
+        size = scene_length(self.randint(10, 25, count))
+        colors = self.colors("Calm", count)
+        alpha = self.randint(100, 180, count)
+        self.art_elements.extend(map(CircleFade, x.tolist(), y.tolist(), size.tolist(), colors, alpha.tolist()))
 
     def generate_excited_art(self):
         # Energetic, vibrant elements
-        for _ in range(20):
-            x = random.randint(0, WIDTH)
-            y = random.randint(0, HEIGHT)
-            size = random.randint(5, 15)
-            color = random.choice(EMOTION_PALETTES["Excited"])
-            speed = random.uniform(0.02, 0.1)
-            direction = random.uniform(0, 2 * math.pi)
-            self.art_elements.append(("particle", x, y, size, color, speed, direction))
-
-        for _ in range(10):
-            x = random.randint(50, WIDTH - 50)
-            y = random.randint(50, HEIGHT - 50)
-            width = random.randint(30, 100)
-            height = random.randint(30, 100)
-            rotation = random.uniform(0, math.pi)
-            color = random.choice(EMOTION_PALETTES["Excited"])
-            self.art_elements.append(("rotated_rect", x, y, width, height, rotation, color))
-
-    def update(self):
-        # Update any animated elements
-        updated_elements = []
-
-        for element in self.art_elements:
-            if element[0] == "particle":
-                _, x, y, size, color, speed, direction = element
-                # Move particle
-                x += speed * math.cos(direction) * 10
-                y += speed * math.sin(direction) * 10
-
-                # Bounce off edges
-                if x < 0 or x > WIDTH:
-                    direction = math.pi - direction
-                if y < 0 or y > HEIGHT:
-                    direction = -direction
-
-                updated_elements.append(("particle", x, y, size, color, speed, direction))
+        self.particles = ParticleSystem(self.scaled(self.particle_count), EMOTION_PALETTES["Excited"], self.rng)
+
+        count = self.scaled(10)
+        x, y = scene_point(self.randint(50, SCENE_WIDTH - 50, count), self.randint(50, SCENE_HEIGHT - 50, count))
+        width = scene_length(self.randint(30, 100, count))
+        height = scene_length(self.randint(30, 100, count))
+        rotation = self.rng.uniform(0, math.pi, count)
+        colors = self.colors("Excited", count)
+        self.art_elements.extend(map(RotatedRect, x.tolist(), y.tolist(), width.tolist(), height.tolist(),
+                                     rotation.tolist(), colors))
+
+    def update(self, dt=FRAME_TIME):
+        """Advance any animated elements by dt seconds"""
+        if self.particles is not None:
+            self.particles.update(dt)
+
+    def invalidate_layers(self):
+        # Force the static layer to be re-rasterized on the next draw
+        self.static_layer = None
+        self.scrolled_layer = None
+        self.animated_rects = []
+
+    def invalidate_scene(self):
+        # The elements changed: drop the layers and the spatial index built over them
+        self.invalidate_layers()
+        self.spatial_index = None
+        self.indexed_elements = None
+
+    def view(self, size):
+        """The view the artwork is shown through on a target of size, after zooming and panning"""
+        return View.cover(size, self.zoom, self.center)
+
+    def zoom_at(self, size, pos, factor):
+        """Zoom by factor about pixel pos of a target of size, keeping the scene point under it in place"""
+        view = self.view(size)
+        zoom = min(MAX_ZOOM, max(1.0, self.zoom * factor))
+        scale = zoom / self.zoom
+        self.zoom = zoom
+        self.move_view(size, pos[0] - (pos[0] - view.x) * scale, pos[1] - (pos[1] - view.y) * scale, view)
+
+    def pan(self, size, dx, dy):
+        """Move the artwork by (dx, dy) pixels on a target of size"""
+        view = self.view(size)
+        self.move_view(size, view.x + dx, view.y + dy)
+
+    def move_view(self, size, x, y, old_view=None):
+        # Put the canvas's top-left corner at (x, y); storing the center the clamped view really
+        # shows means dragging back from an edge responds at once
+        if old_view is None:
+            old_view = self.view(size)
+        unclamped = View.cover(size, self.zoom)
+        self.center = ((size[0] / 2 - x) / unclamped.width, (size[1] / 2 - y) / unclamped.height)
+        view = self.view(size)
+        self.center = view.center(size)
+        old = (old_view.x, old_view.y, old_view.width, old_view.height)
+        if (view.x, view.y, view.width, view.height) == old:
+            # Clamped at an edge or a zoom limit: the layer still shows exactly this
+            return
+        layer = self.static_layer
+        self.invalidate_layers()
+        if layer is not None and layer.get_size() == tuple(size) and (view.width, view.height) == old[2:]:
+            # Same scale, so the next draw can scroll this layer and only rasterize what moved into view
+            self.scrolled_layer = (layer, old_view)
+
+    def reset_view(self):
+        """Show the whole artwork again"""
+        if (self.zoom, self.center) != (1.0, (0.5, 0.5)):
+            self.zoom = 1.0
+            self.center = (0.5, 0.5)
+            self.invalidate_layers()
+
+    def get_spatial_index(self):
+        """The SpatialGrid over art_elements, rebuilt if the list was replaced or resized"""
+        # art_elements may also be replaced or extended directly; elements swapped in place need invalidate_scene()
+        if (self.spatial_index is None or self.indexed_elements is not self.art_elements
+                or len(self.spatial_index) != len(self.art_elements)):
+            self.spatial_index = SpatialGrid([element.bounds() for element in self.art_elements])
+            self.indexed_elements = self.art_elements
+            self.max_thickness = max((element.thickness for element in self.art_elements
+                                      if isinstance(element, (Curve, Line))), default=0)
+        return self.spatial_index
+
+    def visible_elements(self, view, size):
+        """The static elements that may paint on a target of size through view, in draw order"""
+        left, top, right, bottom = view.scene_rect(size, CULL_MARGIN)
+        if left <= 0 and top <= 0 and right >= 1 and bottom >= 1:
+            # The whole canvas is in view; skip the index
+            return self.art_elements
+        elements = self.art_elements
+        candidates = (elements[index] for index in self.get_spatial_index().query(left, top, right, bottom).tolist())
+        return [element for element in candidates if element.intersects(left, top, right, bottom)]
+
+    def build_static_layer(self, size):
+        """Rasterize every visible non-animated element once into a cached surface"""
+        layer = pygame.Surface(size)
+        layer.fill(self.bg_color)
+        view = self.view(size)
+        elements = self.visible_elements(view, size)
+        renderers = ELEMENT_RENDERERS
+        if self.profiler is not None and self.profiler.enabled:
+            # Same loop, but charge each element's render time to its kind
+            timings = {}
+            clock = time.perf_counter_ns
+            for element in elements:
+                start = clock()
+                renderers[type(element)](layer, element, view)
+                timings[element.kind] = timings.get(element.kind, 0) + clock() - start
+            for kind, nanoseconds in timings.items():
+                self.profiler.add(f"art.{kind}", nanoseconds)
+            return layer
+        for element in elements:
+            renderers[type(element)](layer, element, view)
+        return layer
+
+    def get_static_layer(self, size):
+        """Return the static layer at size, reusing a cached render of this seed if there is one"""
+        size = tuple(size)
+        if self.static_layer is not None and self.static_layer.get_size() == size:
+            return self.static_layer
+        if self.scrolled_layer is not None:
+            layer, old_view = self.scrolled_layer
+            self.scrolled_layer = None
+            if layer.get_size() == size:
+                return self.scroll_layer(layer, old_view, self.view(size))
+        if self.scene_key is None or (self.zoom, self.center) != (1.0, (0.5, 0.5)):
+            # Zoomed or panned layers change with every move, so they would only flush the cache
+            return self.build_static_layer(size)
+        return self.render_cache.fetch((*self.scene_key, size), self.build_static_layer, size)
+
+    def scroll_layer(self, layer, old_view, view):
+        """Move a static layer from old_view to view (same scale) and rasterize only the strips it exposes"""
+        width, height = layer.get_size()
+        dx, dy = view.x - old_view.x, view.y - old_view.y
+        if abs(dx) >= width or abs(dy) >= height:
+            return self.build_static_layer((width, height))
+        if self.scene_key is not None and layer is self.render_cache.entries.get((*self.scene_key, (width, height))):
+            # An unzoomed layer is shared with the render cache; leave that copy as it was
+            layer = layer.copy()
+        layer.scroll(dx, dy)
+        strips = []
+        if dy:
+            strips.append(pygame.Rect(0, 0 if dy > 0 else height + dy, width, abs(dy)))
+        if dx:
+            # The rows the horizontal strip doesn't already cover
+            top, bottom = (dy, height) if dy > 0 else (0, height + dy)
+            strips.append(pygame.Rect(0 if dx > 0 else width + dx, top, abs(dx), bottom - top))
+        self.get_spatial_index()
+        for strip in strips:
+            layer.blit(self.render_region_at(view, strip, particles=False), strip)
+        return layer
+
+    def render_artwork(self, emotion, seed, size):
+        """Return a new surface with the artwork for (emotion, seed) at size.
+
+        Rasterized layers come from the render cache, so revisiting a seed
+        only costs regenerating its (cheap) scene description and a copy.
+        """
+        if (emotion, seed) != (self.current_emotion, self.seed):
+            self.generate_art(emotion, seed)
+        surface = self.get_static_layer(size).copy()
+        if self.particles is not None:
+            self.particles.draw(surface, self.view(size), with_rects=False)
+        return surface
+
+    def render_region(self, size, area):
+        """Return the area Rect of the artwork laid out at size, bypassing the caches.
+
+        Lets exports far larger than memory allows be rendered a band at a time.
+        """
+        self.max_thickness = max((element.thickness for element in self.art_elements
+                                  if isinstance(element, (Curve, Line))), default=0)
+        return self.render_region_at(View.cover(size), area)
+
+    def render_region_at(self, view, area, particles=True):
+        """Return the area Rect of the artwork shown through view, using max_thickness.
+
+        Without particles only the static elements are drawn, as for a static layer.
+        """
+        # pygame clips a thick line by its center line, so one just outside the area would lose
+        # the edge that reaches into it; render with a margin as deep as the thickest line
+        margin = view.length(self.max_thickness) if self.max_thickness else 0
+        padded = area.inflate(margin * 2, margin * 2)
+        inner = pygame.Rect((margin, margin), area.size)
+        surface = pygame.Surface(padded.size)
+        surface.fill(self.bg_color)
+        view = view.shifted(padded.x, padded.y)
+        for element in self.visible_elements(view, padded.size):
+            # Only lines need the margin; everything else is clipped to the area itself
+            surface.set_clip(None if isinstance(element, (Curve, Line)) else inner)
+            self.draw_element(surface, element, view)
+        surface.set_clip(inner)
+        if particles and self.particles is not None:
+            self.particles.draw(surface, view, with_rects=False)
+        return surface.subsurface(inner)
+
+    def draw(self, surface, dirty_only=False):
+        """Draw the artwork and return the list of rects that changed.
+
+        With dirty_only, the surface is assumed to still hold the previous
+        frame, so only the regions under the animated elements are redrawn.
+        """
+        timing = self.profiler is not None and self.profiler.enabled
+        if timing:
+            start = time.perf_counter_ns()
+
+        size = surface.get_size()
+        if self.static_layer is None or self.static_layer.get_size() != size:
+            self.static_layer = self.get_static_layer(size)
+            dirty_only = False
+
+        if dirty_only:
+            # Restore the static pixels under last frame's animated elements
+            dirty_rects = self.animated_rects
+            for rect in dirty_rects:
+                surface.blit(self.static_layer, rect, rect)
+        else:
+            surface.blit(self.static_layer, (0, 0))
+            dirty_rects = [surface.get_rect()]
+
+        if timing:
+            now = time.perf_counter_ns()
+            self.profiler.add("art.static_layer", now - start)
+            start = now
+
+        bounds = surface.get_rect()
+        animated_rects = []
+        if self.particles is not None:
+            view = self.view(size)
+            if len(self.particles) > MAX_DIRTY_RECTS:
+                # Too many sprites to track individually; repaint the whole area next frame
+                self.particles.draw(surface, view, with_rects=False)
+                animated_rects = [bounds]
             else:
-                updated_elements.append(element)
+                animated_rects = [rect.clip(bounds) for rect in self.particles.draw(surface, view)]
+        self.animated_rects = animated_rects
+        if timing and self.particles is not None:
+            self.profiler.add("art.particles", time.perf_counter_ns() - start)
+
+        if dirty_only:
+            return dirty_rects + animated_rects
+        return dirty_rects
+
+    def render(self, surface, view=None):
+        """Draw the complete artwork onto surface, bypassing the layer cache"""
+        if view is None:
+            view = View.cover(surface.get_size())
+        surface.fill(self.bg_color)
+        for element in self.visible_elements(view, surface.get_size()):
+            self.draw_element(surface, element, view)
+        if self.particles is not None:
+            self.particles.draw(surface, view, with_rects=False)
 
-        self.art_elements = updated_elements
+    def draw_element(self, surface, element, view):
+        """Draw a single static element through the renderer registry"""
+        ELEMENT_RENDERERS[type(element)](surface, element, view)
 
-    def draw(self, surface):
-        surface.fill(self.bg_color)
-        for element in self.art_elements:
-            if element[0] == "circle":
-                _, x, y, size, color = element
-                pygame.gfxdraw.filled_circle(surface, int(x), int(y), int(size), color)
-                pygame.gfxdraw.aacircle(surface, int(x), int(y), int(size), color)
-            elif element[0] == "polygon":
-                _, points, color = element
-                int_points = [(int(px), int(py)) for px, py in points]
-                pygame.gfxdraw.filled_polygon(surface, int_points, color)
-                pygame.gfxdraw.aapolygon(surface, int_points, color)
-            elif element[0] == "curve":
-                _, points, thickness, color = element
-                if len(points) > 1:
-                    int_points = [(int(px), int(py)) for px, py in points]
-                    pygame.draw.lines(surface, color, False, int_points, int(thickness))
-            elif element[0] == "line":
-                _, x1, y1, x2, y2, thickness, color = element
-                pygame.draw.line(surface, color, (int(x1), int(y1)), (int(x2), int(y2)), int(thickness))
-            elif element[0] == "ring":
-                _, x, y, radius, color, alpha = element
-                r = int(radius)
-                temp_surface = pygame.Surface((r * 2 + 4, r * 2 + 4), pygame.SRCALPHA)
-                pygame.gfxdraw.filled_circle(temp_surface, r + 2, r + 2, r + 2, (*color, int(alpha // 4)))
-                pygame.gfxdraw.aacircle(temp_surface, r + 2, r + 2, r, (*color, int(alpha)))
-                surface.blit(temp_surface, (int(x - r - 2), int(y - r - 2)))
-            elif element[0] == "circle_fade":
-                _, x, y, size, color, alpha = element
-                s = int(size)
-                temp_surface = pygame.Surface((s * 2 + 4, s * 2 + 4), pygame.SRCALPHA)
-                for r in range(s, 0, -1):
-                    a = int(alpha * (r / s))
-                    pygame.gfxdraw.filled_circle(temp_surface, s + 2, s + 2, r, (*color, a))
-                surface.blit(temp_surface, (int(x - s - 2), int(y - s - 2)))
-            elif element[0] == "smooth_curve":
-                _, points, thickness, color = element
-                if len(points) > 1:
-                    int_points = [(int(px), int(py)) for px, py in points]
-                    pygame.draw.lines(surface, color, False, int_points, int(thickness))
-            elif element[0] == "particle":
-                _, x, y, size, color, _, _ = element
-                pygame.gfxdraw.filled_circle(surface, int(x), int(y), int(size), color)
-                pygame.gfxdraw.aacircle(surface, int(x), int(y), int(size), color)
-            elif element[0] == "rotated_rect":
-                _, x, y, width, height, rotation, color = element
-                w, h = int(width), int(height)
-                temp_surface = pygame.Surface((w, h), pygame.SRCALPHA)
-                pygame.draw.rect(temp_surface, color, (0, 0, w, h))
-                rotated = pygame.transform.rotate(temp_surface, float(rotation) * 180 / math.pi)
-                surface.blit(rotated, (int(x - rotated.get_width() // 2), int(y - rotated.get_height() // 2)))
-
-    def save_artwork(self):
-        # Save current artwork as PNG
-        self.save_count += 1
-        filename = f"emotion_art_{self.current_emotion}_{self.save_count}.png"
+    def save_artwork(self, exporter=None, size=(SCENE_WIDTH, SCENE_HEIGHT)):
+        """Save the current artwork at size as a PNG and return its filename.
+
+        With an exporter the file is written in the background; None is
+        returned if the exporter's queue is full.
+        """
+        filename = f"emotion_art_{self.current_emotion}_{self.save_count + 1}.png"
 
         # Create a surface to render the artwork without UI
-        art_surface = pygame.Surface((WIDTH, HEIGHT))
-        self.draw(art_surface)
+        art_surface = self.render_artwork(self.current_emotion, self.seed, size)
 
-        # Save the surface to file
-        pygame.image.save(art_surface, filename)
+        if exporter is None:
+            save_png(art_surface, filename)
+        elif not exporter.submit(filename, art_surface):
+            return None
+        self.save_count += 1
         return filename
 
 
-def draw_button(surface, x, y, width, height, text, color, hover_color, text_color=BUTTON_TEXT):
-    mouse_pos = pygame.mouse.get_pos()
-    clicked = False
-    is_hovered = x <= mouse_pos[0] <= x + width and y <= mouse_pos[1] <= y + height
+class TextCache:
+    """LRU cache of rendered text surfaces keyed by (font, text, color)"""
+
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def render(self, font, text, color):
+        key = (font, text, color)
+        surface = self.entries.get(key)
+        if surface is None:
+            surface = font.render(text, True, color)
+            self.entries[key] = surface
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return surface
 
-    # Create button surface with alpha for smooth edges
+
+text_cache = TextCache()
+
+
+def render_button(width, height, text, color, text_color=BUTTON_TEXT):
+    """Pre-render a rounded button (with its shadow and label) into one surface"""
     button_surface = pygame.Surface((width, height), pygame.SRCALPHA)
-    
-    # Draw button with rounded corners
-    if is_hovered:
-        pygame.draw.rect(button_surface, (*hover_color, 255), (0, 0, width, height), border_radius=BUTTON_BORDER_RADIUS)
-        if pygame.mouse.get_pressed()[0]:
-            clicked = True
-    else:
-        pygame.draw.rect(button_surface, (*color, 255), (0, 0, width, height), border_radius=BUTTON_BORDER_RADIUS)
 
     # Add subtle shadow effect
-    shadow_surface = pygame.Surface((width, height), pygame.SRCALPHA)
-    pygame.draw.rect(shadow_surface, (0, 0, 0, 30), (2, 2, width, height), border_radius=BUTTON_BORDER_RADIUS)
-    surface.blit(shadow_surface, (x, y))
-
-    # Draw button
-    surface.blit(button_surface, (x, y))
+    pygame.draw.rect(button_surface, (0, 0, 0, 30), (2, 2, width, height), border_radius=BUTTON_BORDER_RADIUS)
 
-    # Draw button text with slight shadow for depth
-    text_surf = font.render(text, True, text_color)
-    text_rect = text_surf.get_rect(center=(x + width // 2, y + height // 2))
-    surface.blit(text_surf, text_rect)
+    # Draw button with rounded corners
+    pygame.draw.rect(button_surface, (*color, 255), (0, 0, width, height), border_radius=BUTTON_BORDER_RADIUS)
 
-    return clicked
+    text_surf = text_cache.render(font, text, text_color)
+    button_surface.blit(text_surf, text_surf.get_rect(center=(width // 2, height // 2)))
+    return button_surface
 
 
 # Load icons (optional, fallback to text if not found)
@@ -356,146 +2064,857 @@ def load_icon(path, size):
         return None
 
 
-def draw_sidebar(surface, width, height, selected_emotion, music_on, on_emotion, on_music, on_save, can_save, sidebar_width=240):
-    # Sidebar background
-    sidebar = pygame.Surface((sidebar_width, height), pygame.SRCALPHA)
-    pygame.draw.rect(sidebar, SIDEBAR_BG, (0, 0, sidebar_width, height), border_radius=0)
-    # Sidebar shadow
-    shadow = pygame.Surface((12, height), pygame.SRCALPHA)
-    pygame.draw.rect(shadow, SIDEBAR_SHADOW, (0, 0, 12, height), border_radius=0)
-    surface.blit(shadow, (sidebar_width, 0))
-    surface.blit(sidebar, (0, 0))
-
-    # Title at the very top, centered
-    title = title_font.render("Emotion Art", True, (40, 60, 120))
-    title_x = (sidebar_width - title.get_width()) // 2
-    title_y = 24
-    surface.blit(title, (title_x, title_y))
-
-    # Emotion buttons start below the title
-    button_y = title_y + title.get_height() + 32
-    button_h = 48
-    button_gap = 18
-    button_w = sidebar_width - 50
-    for emotion in EMOTION_PALETTES.keys():
-        is_selected = (emotion == selected_emotion)
-        btn_color = EMOTION_PALETTES[emotion][0] if is_selected else BUTTON_BG
-        btn_text_color = (255, 255, 255) if is_selected else BUTTON_TEXT
-        if draw_button(surface, 25, button_y, button_w, button_h, emotion, btn_color, SIDEBAR_ACCENT, btn_text_color):
-            on_emotion(emotion)
-        button_y += button_h + button_gap
-
-    # Music toggle and save button below emotion buttons
-    action_gap = 24
-    music_btn_y = button_y + action_gap
-    if draw_button(surface, 25, music_btn_y, button_w, 40, "Music: ON" if music_on else "Music: OFF", BUTTON_BG, (100, 200, 100) if music_on else (200, 100, 100), BUTTON_TEXT):
-        on_music()
-    save_btn_y = music_btn_y + 40 + 14
-    if can_save and draw_button(surface, 25, save_btn_y, button_w, 40, "Save Artwork", BUTTON_BG, (100, 100, 200), BUTTON_TEXT):
-        on_save()
-
-    # Instructions at the very bottom
-    instr_font = pygame.font.SysFont('Segoe UI', 16)
-    instr1 = instr_font.render("ESC: Hide/Show UI", True, (80, 80, 80))
-    instr2 = instr_font.render("M: Toggle Music", True, (80, 80, 80))
-    instr3 = instr_font.render("S: Save Artwork", True, (80, 80, 80))
-    instr_height = instr1.get_height() + instr2.get_height() + instr3.get_height() + 16
-    instr_y = height - instr_height - 18
-    surface.blit(instr1, (25, instr_y))
-    surface.blit(instr2, (25, instr_y + instr1.get_height() + 4))
-    surface.blit(instr3, (25, instr_y + instr1.get_height() + instr2.get_height() + 8))
-
-
-def main():
+class Sidebar:
+    """Retained-mode sidebar.
+
+    The whole panel is composed into one surface and only re-composed when
+    its visual state (hover, selection, music, save availability or window
+    height) changes; otherwise drawing it is a single blit.
+    """
+
+    def __init__(self, width=240):
+        ensure_init(fonts=True)
+        self.width = width
+        self.surface = None
+        self.state = None
+        self.height = None
+        self.can_save = False
+        self.buttons = []
+        self.button_cache = {}
+
+    @property
+    def rect(self):
+        # The sidebar plus its 12px drop shadow
+        return pygame.Rect(0, 0, self.width + 12, self.height or 0)
+
+    def layout(self, height):
+        """Compute button rects for the given window height"""
+        if height == self.height:
+            return
+        self.height = height
+        self.buttons = []
+
+        # Emotion buttons start below the title
+        title_y = 24
+        button_y = title_y + title_font.get_height() + 32
+        button_h = 48
+        button_gap = 18
+        button_w = self.width - 50
+        for emotion in EMOTION_PALETTES.keys():
+            self.buttons.append((emotion, pygame.Rect(25, button_y, button_w, button_h)))
+            button_y += button_h + button_gap
+
+        # Music toggle and save button below emotion buttons
+        action_gap = 24
+        music_btn_y = button_y + action_gap
+        self.buttons.append(("music", pygame.Rect(25, music_btn_y, button_w, 40)))
+        save_btn_y = music_btn_y + 40 + 14
+        self.buttons.append(("save", pygame.Rect(25, save_btn_y, button_w, 40)))
+
+    def button_at(self, pos):
+        """Return the key of the button under pos (an emotion, "music" or "save"), or None"""
+        for key, rect in self.buttons:
+            if key == "save" and not self.can_save:
+                continue
+            if rect.collidepoint(pos):
+                return key
+        return None
+
+    def get_button(self, rect, text, color, text_color):
+        key = (rect.size, text, color, text_color)
+        button = self.button_cache.get(key)
+        if button is None:
+            button = render_button(rect.width, rect.height, text, color, text_color)
+            self.button_cache[key] = button
+        return button
+
+    def update(self, height, selected_emotion, music_on, can_save, mouse_pos):
+        """Re-compose the sidebar if its visual state changed; return True if it did"""
+        self.layout(height)
+        self.can_save = can_save
+        hovered = self.button_at(mouse_pos)
+        state = (height, selected_emotion, music_on, can_save, hovered)
+        if state == self.state:
+            return False
+        self.state = state
+        self.compose(height, selected_emotion, music_on, can_save, hovered)
+        return True
+
+    def compose(self, height, selected_emotion, music_on, can_save, hovered):
+        if self.surface is None or self.surface.get_height() != height:
+            self.surface = pygame.Surface((self.width + 12, height))
+        # Sidebar background and shadow
+        self.surface.fill(SIDEBAR_BG, (0, 0, self.width, height))
+        self.surface.fill(SIDEBAR_SHADOW, (self.width, 0, 12, height))
+
+        # Title at the very top, centered
+        title = text_cache.render(title_font, "Emotion Art", (40, 60, 120))
+        self.surface.blit(title, ((self.width - title.get_width()) // 2, 24))
+
+        for key, rect in self.buttons:
+            if key == "save":
+                if not can_save:
+                    continue
+                text, color, hover_color = "Save Artwork", BUTTON_BG, (100, 100, 200)
+                text_color = BUTTON_TEXT
+            elif key == "music":
+                text = "Music: ON" if music_on else "Music: OFF"
+                color, hover_color = BUTTON_BG, (100, 200, 100) if music_on else (200, 100, 100)
+                text_color = BUTTON_TEXT
+            else:
+                is_selected = (key == selected_emotion)
+                text, hover_color = key, SIDEBAR_ACCENT
+                color = EMOTION_PALETTES[key][0] if is_selected else BUTTON_BG
+                text_color = (255, 255, 255) if is_selected else BUTTON_TEXT
+            if key == hovered:
+                color = hover_color
+            self.surface.blit(self.get_button(rect, text, color, text_color), rect)
+
+        # Instructions at the very bottom
+        lines = [text_cache.render(instr_font, line, (80, 80, 80)) for line in SIDEBAR_INSTRUCTIONS]
+        instr_height = sum(line.get_height() for line in lines) + 16
+        instr_y = height - instr_height - 18
+        for line in lines:
+            self.surface.blit(line, (25, instr_y))
+            instr_y += line.get_height() + 4
+
+    def draw(self, surface):
+        surface.blit(self.surface, (0, 0))
+
+
+def wake_main_loop():
+    # SDL's event queue is thread-safe, so worker threads can post directly
+    pygame.event.post(pygame.event.Event(WAKE_EVENT))
+
+
+def main(particle_count=PARTICLE_COUNT, compression=PNG_COMPRESSION, profile=False, profile_trace=None,
+         max_fps=ANIMATION_FPS, audio=True):
+    ensure_init(window=True, audio=audio, fonts=True)
     clock = pygame.time.Clock()
-    generator = EmotionArtGenerator()
+    generator = EmotionArtGenerator(particle_count)
     running = True
     show_sidebar = True
     save_message = None
     save_message_time = 0
+    full_redraw = True
+    # (emotion, seed) of every artwork shown, so arrow keys can revisit them from the render cache
+    history = []
+    history_index = -1
     gradient_top = (230, 245, 255)
     gradient_bottom = (180, 210, 255)
-
-    # Initialize screen locally in main
-    WIDTH, HEIGHT = 800, 600
-    screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+    background = GradientBackground(gradient_top, gradient_bottom)
+    exporter = PngExporter(compression, notify=wake_main_loop)
+    music = MusicPlayer(notify=wake_main_loop)
+    sidebar = Sidebar()
+    art_surface = None
+    # F3 toggles the profiler and its overlay; a trace file implies profiling from the start, and then
+    # F3 only toggles the overlay so the trace has no gaps
+    profiler = FrameProfiler(enabled=profile or profile_trace is not None, record_trace=profile_trace is not None)
+    generator.profiler = profiler
+    show_hud = profiler.enabled
+    hud = None
+    hud_time = 0
+    # Last mouse position while the artwork is being dragged
+    drag_pos = None
+
+    screen = pygame.display.set_mode(WINDOW_SIZE, pygame.RESIZABLE)
     pygame.display.set_caption("Emotion-Based Art Generator")
-
-    def on_emotion(emotion):
-        generator.generate_art(emotion)
-        # Play music if enabled and file exists
-        mixer.music.stop()
-        if generator.music_enabled and emotion in MUSIC_FILES and os.path.exists(MUSIC_FILES[emotion]):
-            try:
-                mixer.music.load(MUSIC_FILES[emotion])
-                mixer.music.play(-1)
-            except Exception as e:
-                print(f"Music error: {e}")
+    background.get(screen.get_size())
+
+    def on_emotion(emotion, seed=None):
+        nonlocal full_redraw, history_index
+        generator.generate_art(emotion, seed)
+        if seed is None:
+            history.append((emotion, generator.seed))
+            history_index = len(history) - 1
+        full_redraw = True
+        if generator.music_enabled:
+            music.play(emotion)
 
     def on_music():
         generator.music_enabled = not generator.music_enabled
         if not generator.music_enabled:
-            mixer.music.stop()
+            music.stop()
         elif generator.current_emotion:
-            on_emotion(generator.current_emotion)
+            music.play(generator.current_emotion)
 
     def on_save():
-        nonlocal save_message, save_message_time
-        filename = generator.save_artwork()
-        save_message = f"Saved as {filename}"
-        save_message_time = pygame.time.get_ticks()
+        # Saved at the size of the art area, exactly as it is shown
+        filename = generator.save_artwork(exporter, art_surface.get_size())
+        if filename is None:
+            show_message("Still saving earlier artworks, try again in a moment")
+        else:
+            show_message(f"Saving {filename} (seed {generator.seed})...")
 
+    def show_message(text):
+        nonlocal save_message, save_message_time, full_redraw
+        save_message = text
+        save_message_time = pygame.time.get_ticks()
+        full_redraw = True
+
+    def art_rect():
+        # The art area: the window right of the sidebar, if it is shown
+        sidebar_width = sidebar.width if show_sidebar else 0
+        width, height = screen.get_size()
+        return pygame.Rect(sidebar_width, 0, width - sidebar_width, height)
+
+    def idle_timeout():
+        """Milliseconds until the next timed repaint, or 0 if only an event can change the screen"""
+        deadlines = []
+        if save_message:
+            deadlines.append(save_message_time + MESSAGE_DURATION_MS)
+        if show_hud:
+            deadlines.append(hud_time + HUD_REFRESH_MS)
+        if not deadlines:
+            return 0
+        return max(1, min(deadlines) - pygame.time.get_ticks())
+
+    # Seconds the next animation update advances by
+    frame_time = FRAME_TIME
     while running:
-        for event in pygame.event.get():
+        if generator.particles is not None or full_redraw:
+            events = pygame.event.get()
+        else:
+            # Nothing is moving: sleep until input, a worker thread's wake-up or the next timed repaint
+            event = pygame.event.wait(idle_timeout())
+            events = [event] + pygame.event.get() if event.type != pygame.NOEVENT else []
+            # Restart the frame clock so the time spent asleep isn't taken as an animation step
+            clock.tick()
+
+        profiler.begin_frame()
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
                     show_sidebar = not show_sidebar
+                    full_redraw = True
                     if not show_sidebar:
-                        mixer.music.stop()
+                        music.stop()
                 elif event.key == pygame.K_m:
                     on_music()
                 elif event.key == pygame.K_s:
                     if generator.current_emotion:
                         on_save()
+                elif event.key == pygame.K_F3:
+                    show_hud = not show_hud
+                    if profile_trace is None:
+                        profiler.enabled = show_hud
+                    hud = None
+                    full_redraw = True
+                elif event.key == pygame.K_r:
+                    generator.reset_view()
+                    full_redraw = True
+                elif event.key in (pygame.K_LEFT, pygame.K_RIGHT) and history:
+                    step = 1 if event.key == pygame.K_RIGHT else -1
+                    history_index = max(0, min(len(history) - 1, history_index + step))
+                    on_emotion(*history[history_index])
+            elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+                button = sidebar.button_at(event.pos) if show_sidebar else None
+                if button == "music":
+                    on_music()
+                elif button == "save":
+                    on_save()
+                elif button is not None:
+                    on_emotion(button)
+                elif generator.current_emotion and art_rect().collidepoint(event.pos):
+                    drag_pos = event.pos
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+                drag_pos = None
+            elif event.type == pygame.MOUSEMOTION and drag_pos is not None:
+                generator.pan(art_rect().size, event.pos[0] - drag_pos[0], event.pos[1] - drag_pos[1])
+                drag_pos = event.pos
+                full_redraw = True
+            elif event.type == pygame.MOUSEWHEEL and generator.current_emotion:
+                # Zoom about the point under the cursor
+                area = art_rect()
+                mouse_x, mouse_y = pygame.mouse.get_pos()
+                if area.collidepoint(mouse_x, mouse_y):
+                    generator.zoom_at(area.size, (mouse_x - area.x, mouse_y - area.y), ZOOM_STEP ** event.y)
+                    full_redraw = True
             elif event.type == pygame.VIDEORESIZE:
                 WIDTH, HEIGHT = event.w, event.h
                 screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.RESIZABLE)
+                # Rebuild the cached gradient only when the window size changes
+                background.get(screen.get_size())
+                full_redraw = True
+            elif event.type in EXPOSE_EVENTS:
+                # Uncovered or restored: without a compositor the OS kept none of the idle frame
+                full_redraw = True
+
+        music.poll()
+        for filename, error in exporter.poll():
+            show_message(f"Save failed: {str(error) or type(error).__name__}" if error else f"Saved as {filename}")
 
         WIDTH, HEIGHT = screen.get_size()
-        sidebar_width = 240 if show_sidebar else 0
+        sidebar_width = sidebar.width if show_sidebar else 0
         art_x = sidebar_width
         art_w = WIDTH - sidebar_width
         art_h = HEIGHT
 
-        draw_gradient_background(screen, gradient_top, gradient_bottom)
-        if generator.current_emotion in ["Excited"]:
-            generator.update()
-
-        art_shadow = pygame.Surface((art_w + 16, art_h + 16), pygame.SRCALPHA)
-        pygame.draw.rect(art_shadow, ART_SHADOW, (8, 8, art_w, art_h), border_radius=24)
-        screen.blit(art_shadow, (art_x - 8, -8))
-        art_surface = screen.subsurface((art_x, 0, art_w, art_h))
-        generator.draw(art_surface)
+        if save_message and pygame.time.get_ticks() - save_message_time >= MESSAGE_DURATION_MS:
+            # The toast expired, so the art underneath has to be repainted
+            save_message = None
+            full_redraw = True
+
+        profiler.mark("events")
+
+        if generator.particles is not None:
+            generator.update(frame_time)
+        profiler.mark("update")
+
+        redraw_all = full_redraw
+        full_redraw = False
+
+        if redraw_all:
+            background.draw(screen)
+            art_shadow = pygame.Surface((art_w + 16, art_h + 16), pygame.SRCALPHA)
+            pygame.draw.rect(art_shadow, ART_SHADOW, (8, 8, art_w, art_h), border_radius=24)
+            screen.blit(art_shadow, (art_x - 8, -8))
+        profiler.mark("background")
+        if art_surface is None or art_surface.get_parent() is not screen or art_surface.get_abs_offset() != (art_x, 0) \
+                or art_surface.get_size() != (art_w, art_h):
+            art_surface = screen.subsurface((art_x, 0, art_w, art_h))
+        # Only the regions the generator actually repainted are pushed to the display
+        dirty_rects = [rect.move(art_x, 0) for rect in generator.draw(art_surface, dirty_only=not redraw_all)]
+        profiler.mark("art")
 
         if show_sidebar:
-            draw_sidebar(screen, WIDTH, HEIGHT, generator.current_emotion, generator.music_enabled, on_emotion, on_music, on_save, generator.current_emotion is not None, sidebar_width)
-
-        if save_message and pygame.time.get_ticks() - save_message_time < 3000:
-            msg_surf = font.render(save_message, True, (30, 30, 30))
-            pygame.draw.rect(screen, (255, 255, 255), (art_x + 40, HEIGHT - 60, msg_surf.get_width() + 20, 40), border_radius=10)
-            screen.blit(msg_surf, (art_x + 50, HEIGHT - 50))
+            changed = sidebar.update(HEIGHT, generator.current_emotion, generator.music_enabled,
+                                     generator.current_emotion is not None, pygame.mouse.get_pos())
+            # Particles may have been drawn over the sidebar's drop shadow
+            if redraw_all or changed or sidebar.rect.collidelist(dirty_rects) != -1:
+                sidebar.draw(screen)
+                dirty_rects.append(sidebar.rect)
+        profiler.mark("sidebar")
+
+        if save_message:
+            msg_surf = text_cache.render(font, save_message, (30, 30, 30))
+            toast_rect = pygame.Rect(art_x + 40, HEIGHT - 60, msg_surf.get_width() + 20, 40)
+            if redraw_all or toast_rect.collidelist(dirty_rects) != -1:
+                pygame.draw.rect(screen, (255, 255, 255), toast_rect, border_radius=10)
+                screen.blit(msg_surf, (art_x + 50, HEIGHT - 50))
+                dirty_rects.append(toast_rect)
+
+        if show_hud:
+            # Refresh the overlay a few times a second rather than re-rendering text every frame
+            if hud is None or pygame.time.get_ticks() - hud_time >= HUD_REFRESH_MS:
+                hud = render_profile_hud(profiler)
+                hud_time = pygame.time.get_ticks()
+            hud_rect = hud.get_rect(topright=(WIDTH - 10, 10))
+            screen.blit(hud, hud_rect)
+            dirty_rects.append(hud_rect)
+        profiler.mark("overlay")
+
+        if redraw_all:
+            pygame.display.flip()
         else:
-            save_message = None
-
-        pygame.display.flip()
-        clock.tick(60)
-
-    mixer.music.stop()
+            pygame.display.update(dirty_rects)
+        profiler.mark("present")
+        if generator.particles is not None:
+            # Hold the frame cap; the next update advances by the time that really passed
+            frame_time = min(clock.tick(max_fps) / 1000, MAX_FRAME_STEP)
+        profiler.mark("tick")
+        profiler.end_frame()
+
+    # Let queued saves reach the disk before exiting
+    exporter.close()
+    if profile_trace:
+        profiler.save_trace(profile_trace)
+        kept = len(profiler.trace)
+        dropped = f" (the last {kept} of {profiler.frame_index})" if kept < profiler.frame_index else ""
+        print(f"Wrote {kept} frames{dropped} of profile trace to {profile_trace}")
+    music.close()
     pygame.quit()
     sys.exit()
 
 
+def parse_size(text):
+    """Parse a WIDTHxHEIGHT string such as 1920x1080"""
+    try:
+        width, height = (int(part) for part in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"size must be positive, got {text!r}")
+    return width, height
+
+
+def process_pool(workers):
+    """Return a pool of worker processes for headless rendering"""
+    # Spawn rather than fork: forked children inherit SDL's audio/video threads and can deadlock
+    return multiprocessing.get_context("spawn").Pool(workers)
+
+
+def batch_filename(output_dir, emotion, index, digits):
+    return os.path.join(output_dir, f"emotion_art_{emotion}_{index:0{digits}d}.png")
+
+
+def render_batch_chunk(job):
+    """Render and encode one chunk of a batch job (runs in a worker process)"""
+    emotion, indices, size, output_dir, digits, base_seed, compression, particle_count = job
+    generator = EmotionArtGenerator(particle_count)
+    surface = pygame.Surface(size)
+    for index in indices:
+        # Image i is always generated from base_seed + i, so a run can be reproduced exactly
+        generator.generate_art(emotion, seed=(base_seed + index) % 2 ** 64)
+        generator.render(surface)
+        save_png(surface, batch_filename(output_dir, emotion, index, digits), compression)
+    return len(indices)
+
+
+def render_batch(emotion, count, size, workers, output_dir, seed=None, compression=PNG_COMPRESSION,
+                 chunk_size=16, particle_count=PARTICLE_COUNT):
+    """Render count artworks headless across a process pool and report throughput"""
+    os.makedirs(output_dir, exist_ok=True)
+    if seed is None:
+        seed = random.getrandbits(64)
+    digits = max(5, len(str(count - 1)))
+    jobs = [
+        (emotion, range(start, min(start + chunk_size, count)), size, output_dir, digits, seed, compression, particle_count)
+        for start in range(0, count, chunk_size)
+    ]
+
+    start_time = time.perf_counter()
+    done = 0
+    if workers <= 1:
+        for job in jobs:
+            done += render_batch_chunk(job)
+    else:
+        with process_pool(workers) as pool:
+            for rendered in pool.imap_unordered(render_batch_chunk, jobs):
+                done += rendered
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Rendered {done} {emotion} artworks at {size[0]}x{size[1]} in {elapsed:.2f} s "
+          f"({done / elapsed:.1f} images/sec, {workers} worker(s)) into {output_dir}, base seed {seed}")
+    return done / elapsed
+
+
+def export_band(job):
+    """Render rows [top, top + rows) of a tiled export as RGB24 pixels (may run in a worker process)"""
+    emotion, seed, size, top, rows, particle_count = job
+    # Regenerating the scene is far cheaper than rasterizing a band, so each band starts fresh
+    generator = EmotionArtGenerator(particle_count)
+    generator.generate_art(emotion, seed)
+    band = generator.render_region(size, pygame.Rect(0, top, size[0], rows))
+    return surface_rgb(band)
+
+
+def bounded_imap(pool, func, jobs, max_pending):
+    """Like pool.imap, but with at most max_pending results in flight so a slow consumer bounds memory"""
+    pending = deque()
+    for job in jobs:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (job,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def export_tiled(emotion, seed, size, filename, workers=1, compression=PNG_COMPRESSION,
+                 particle_count=PARTICLE_COUNT, band_rows=None):
+    """Render one artwork at size (e.g. 15360x8640) band by band, streaming the bands into a PNG.
+
+    Bands are full-width strips, so each one is a run of PNG rows that can be
+    compressed and written as soon as it is rendered. Only a couple of bands
+    per worker are alive at once: peak memory follows EXPORT_TILE_BYTES, not
+    the size of the canvas.
+    """
+    width, height = size
+    if max(size) > MAX_EXPORT_SIZE:
+        raise ValueError(f"exports are limited to {MAX_EXPORT_SIZE} pixels per side")
+    if seed is None:
+        seed = random.getrandbits(64)
+    if band_rows is None:
+        band_rows = max(1, EXPORT_TILE_BYTES // (width * 4))
+    jobs = [(emotion, seed, size, top, min(band_rows, height - top), particle_count)
+            for top in range(0, height, band_rows)]
+
+    start_time = time.perf_counter()
+    with open(filename, "wb") as file:
+        if workers <= 1:
+            write_png(file, width, height, map(export_band, jobs), compression)
+        else:
+            with process_pool(workers) as pool:
+                write_png(file, width, height, bounded_imap(pool, export_band, jobs, workers * 2), compression)
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Exported {emotion} seed {seed} at {width}x{height} in {len(jobs)} bands of up to {band_rows} rows "
+          f"in {elapsed:.2f} s ({workers} worker(s)) to {filename}")
+    return seed
+
+
+def animation_frames(generator, size, frame_count, fps):
+    """Yield frame_count RGB24 frames of the generator's artwork, advancing a fixed 1/fps per frame.
+
+    Frames are rendered offscreen into one reused surface; after the first,
+    only the regions under moving elements are repainted.
+    """
+    surface = pygame.Surface(size)
+    dirty_only = False
+    for _ in range(frame_count):
+        generator.draw(surface, dirty_only=dirty_only)
+        dirty_only = True
+        yield surface_rgb(surface)
+        generator.update(1 / fps)
+
+
+def encode_frame(job):
+    filename, size, rgb, compression = job
+    with open(filename, "wb") as file:
+        write_png(file, size[0], size[1], [rgb], compression)
+    return filename
+
+
+def export_animation(emotion, seed, size, duration, fps, output_dir="animation_frames", pipe=None, workers=1,
+                     compression=PNG_COMPRESSION, particle_count=PARTICLE_COUNT):
+    """Render duration seconds of the animation offscreen at a fixed timestep of 1/fps.
+
+    Frames go to a numbered PNG sequence in output_dir, encoded by a pool of
+    threads (zlib releases the GIL), or as raw RGB24 video to the stdin of
+    the pipe command, e.g. an ffmpeg process; {width}, {height} and {fps} in
+    the command are filled in, and any other braces (as in ffmpeg filter
+    expressions) are passed through unchanged. Rendering blocks until the encoders or the
+    pipe catch up, so only a few frames are ever held in memory.
+    """
+    if seed is None:
+        seed = random.getrandbits(64)
+    generator = EmotionArtGenerator(particle_count)
+    generator.generate_art(emotion, seed)
+    frame_count = round(duration * fps)
+    frames = animation_frames(generator, size, frame_count, fps)
+
+    start_time = time.perf_counter()
+    if pipe is not None:
+        # Substituted one by one rather than with str.format, which would choke on filter braces
+        for name, value in (("width", size[0]), ("height", size[1]), ("fps", fps)):
+            pipe = pipe.replace("{" + name + "}", str(value))
+        command = shlex.split(pipe)
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        closed_early = False
+        try:
+            for frame in frames:
+                process.stdin.write(frame)
+        except BrokenPipeError:
+            # The encoder exited early; its exit status below says why
+            closed_early = True
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                closed_early = True
+            process.wait()
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        if closed_early:
+            raise OSError(f"{command[0]} stopped reading frames before the animation ended")
+        target = command[0]
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        digits = max(5, len(str(frame_count - 1)))
+        jobs = ((os.path.join(output_dir, f"frame_{index:0{digits}d}.png"), size, frame, compression)
+                for index, frame in enumerate(frames))
+        with ThreadPool(workers) as pool:
+            for _ in bounded_imap(pool, encode_frame, jobs, workers * 2):
+                pass
+        target = output_dir
+    elapsed = time.perf_counter() - start_time
+
+    print(f"Rendered {frame_count} frames of {emotion} (seed {seed}) at {size[0]}x{size[1]}, {fps} fps "
+          f"in {elapsed:.2f} s ({frame_count / elapsed:.1f} frames/sec, {duration / elapsed:.1f}x real time) to {target}")
+    return seed
+
+
+def render_png(job):
+    """Render one artwork and return (PNG bytes, render seconds) (runs in a worker process)"""
+    emotion, seed, size, compression, particle_count = job
+    start = time.perf_counter()
+    generator = EmotionArtGenerator(particle_count)
+    generator.generate_art(emotion, seed)
+    surface = pygame.Surface(size)
+    generator.render(surface)
+    buffer = io.BytesIO()
+    write_png(buffer, size[0], size[1], [surface_rgb(surface)], compression)
+    return buffer.getvalue(), time.perf_counter() - start
+
+
+class ArtRequestHandler(BaseHTTPRequestHandler):
+    """GET /art?emotion=Calm&seed=42&w=1024&h=768 returns a PNG, GET /metrics returns JSON"""
+    # Keep-alive, so clients don't pay for a new connection per image
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(self.path)
+        if url.path == "/art":
+            status, outcome = self.send_art(urllib.parse.parse_qs(url.query))
+            self.server.record(status, outcome, time.perf_counter() - start)
+        elif url.path == "/metrics":
+            self.send_body(200, "application/json", json.dumps(self.server.metrics(), indent=1).encode())
+        else:
+            self.send_body(404, "text/plain", b"not found\n")
+
+    def send_art(self, params):
+        """Validate the query and send the artwork; return (status, cache outcome)"""
+        try:
+            emotion = params["emotion"][0]
+            if emotion not in EMOTION_PALETTES:
+                raise ValueError(f"unknown emotion {emotion!r}")
+            # Without a seed every request is a new artwork, reported in X-Seed so it can be fetched again
+            seed = int(params["seed"][0]) % 2 ** 64 if "seed" in params else random.getrandbits(64)
+            size = (int(params.get("w", [SCENE_WIDTH])[0]), int(params.get("h", [SCENE_HEIGHT])[0]))
+            if not all(0 < side <= self.server.max_side for side in size):
+                raise ValueError(f"w and h must be between 1 and {self.server.max_side}")
+        except KeyError as e:
+            self.send_body(400, "text/plain", f"missing parameter {e}\n".encode())
+            return 400, None
+        except ValueError as e:
+            self.send_body(400, "text/plain", f"{e}\n".encode())
+            return 400, None
+
+        try:
+            png, outcome = self.server.get_png(emotion, seed, size)
+        except multiprocessing.TimeoutError:
+            self.send_body(503, "text/plain", b"render timed out, try again\n", {"Retry-After": "1"})
+            return 503, None
+        except queue.Full:
+            self.send_body(503, "text/plain", b"too many renders queued, try again\n", {"Retry-After": "1"})
+            return 503, None
+        except Exception as e:
+            self.send_body(500, "text/plain", f"render failed: {e}\n".encode())
+            return 500, None
+        headers = {"X-Seed": str(seed), "X-Cache": outcome}
+        if "seed" in params:
+            # The same seed always renders the same image
+            headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        self.send_body(200, "image/png", png, headers)
+        return 200, outcome
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Per-request lines would swamp the console under load; /metrics has the numbers
+        pass
+
+
+class ArtServer(ThreadingHTTPServer):
+    """Headless HTTP render service backed by a pool of worker processes.
+
+    Identical requests that arrive while one is rendering wait for that
+    render instead of starting their own, and encoded PNGs are kept in an
+    LRU bounded by cache_bytes. At most max_queued renders (by default
+    RENDER_QUEUE_PER_WORKER per worker) are queued or running at once.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, workers, cache_bytes=RESPONSE_CACHE_BYTES, compression=PNG_COMPRESSION,
+                 particle_count=PARTICLE_COUNT, max_side=MAX_SERVE_SIZE, render_timeout=RENDER_TIMEOUT,
+                 max_queued=None):
+        super().__init__(address, ArtRequestHandler)
+        self.workers = workers
+        self.compression = compression
+        self.particle_count = particle_count
+        self.max_side = max_side
+        self.render_timeout = render_timeout
+        self.max_queued = workers * RENDER_QUEUE_PER_WORKER if max_queued is None else max_queued
+        self.pool = process_pool(workers)
+        self.cache = RenderCache(cache_bytes, sizeof=len)
+        # Guards cache, inflight, jobs and the metrics below; handler threads and pool callbacks share them
+        self.lock = threading.Lock()
+        # key -> (token, AsyncResult) of the render identical requests wait on
+        self.inflight = {}
+        # Submit times of the renders that are queued or running, by token
+        self.jobs = {}
+        self.started = time.perf_counter()
+        self.counts = {"requests": 0, "hit": 0, "coalesced": 0, "rendered": 0, "errors": 0}
+        # (finish time, seconds) of recent requests and of recent renders
+        self.latencies = deque(maxlen=METRICS_WINDOW)
+        self.render_times = deque(maxlen=METRICS_WINDOW)
+
+    def get_png(self, emotion, seed, size):
+        """Return (PNG bytes, outcome) where outcome is "hit", "coalesced" or "rendered".
+
+        Raises queue.Full if max_queued renders are already pending, and
+        multiprocessing.TimeoutError if the render takes longer than
+        render_timeout, e.g. because its worker process died.
+        """
+        key = (emotion, seed, size)
+        with self.lock:
+            png = self.cache.get(key)
+            if png is not None:
+                return png, "hit"
+            entry = self.inflight.get(key)
+            owner = entry is None
+            if owner:
+                # A worker that died never reports back, so give up counting its job after twice the timeout
+                now = time.perf_counter()
+                for stale in [token for token, submitted in self.jobs.items() if now - submitted > 2 * self.render_timeout]:
+                    del self.jobs[stale]
+                if len(self.jobs) >= self.max_queued:
+                    raise queue.Full(f"{len(self.jobs)} renders already pending")
+                token = object()
+                job = (emotion, seed, size, self.compression, self.particle_count)
+                # The callbacks run on the pool's result thread, and block on the lock until inflight is set
+                pending = self.pool.apply_async(render_png, (job,),
+                                                callback=lambda result: self.finish_render(key, token, result),
+                                                error_callback=lambda error: self.drop_render(key, token))
+                entry = self.inflight[key] = (token, pending)
+                self.jobs[token] = now
+        token, pending = entry
+        try:
+            # The callback has cached the PNG by the time get() returns
+            png, seconds = pending.get(timeout=self.render_timeout)
+        except multiprocessing.TimeoutError:
+            # The worker may have died, so later identical requests start a fresh render instead of
+            # waiting on this one; a render that was only slow is still cached when it finishes
+            with self.lock:
+                if self.inflight.get(key, (None,))[0] is token:
+                    del self.inflight[key]
+            raise
+        return png, "rendered" if owner else "coalesced"
+
+    def finish_render(self, key, token, result):
+        """Pool callback: cache a finished render, even one its requests stopped waiting for"""
+        png, seconds = result
+        with self.lock:
+            # Cache before leaving inflight, so no request can miss both
+            self.cache.put(key, png)
+            self.render_times.append((time.perf_counter(), seconds))
+        self.drop_render(key, token)
+
+    def drop_render(self, key, token):
+        """Pool callback: forget a render that finished or failed"""
+        with self.lock:
+            self.jobs.pop(token, None)
+            if self.inflight.get(key, (None,))[0] is token:
+                del self.inflight[key]
+
+    def record(self, status, outcome, seconds):
+        with self.lock:
+            self.counts["requests"] += 1
+            if status != 200:
+                self.counts["errors"] += 1
+            elif outcome is not None:
+                self.counts[outcome] += 1
+            self.latencies.append((time.perf_counter(), seconds))
+
+    def metrics(self):
+        """Counters, throughput and latency percentiles as a JSON-ready dict"""
+        with self.lock:
+            now = time.perf_counter()
+            latencies = sorted(seconds for _, seconds in self.latencies)
+            renders = sorted(seconds for _, seconds in self.render_times)
+            recent = now - self.latencies[0][0] if self.latencies else 0
+            result = {
+                "uptime_s": round(now - self.started, 3),
+                "workers": self.workers,
+                **self.counts,
+                "requests_per_s": round(self.counts["requests"] / (now - self.started), 2),
+                "recent_requests_per_s": round(len(latencies) / recent, 2) if recent > 0 else 0.0,
+                "latency_ms": {f"p{q}": round(percentile(latencies, q) * 1000, 3) for q in (50, 95, 99)},
+                "render_ms": {f"p{q}": round(percentile(renders, q) * 1000, 3) for q in (50, 95, 99)},
+                "inflight": len(self.inflight),
+                "queued": len(self.jobs),
+                "cache": {"entries": len(self.cache), "bytes": self.cache.total_bytes, "max_bytes": self.cache.max_bytes},
+            }
+        return result
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+
+
+def serve(host, port, workers, cache_bytes=RESPONSE_CACHE_BYTES, compression=PNG_COMPRESSION,
+          particle_count=PARTICLE_COUNT):
+    """Run the HTTP render service until interrupted"""
+    server = ArtServer((host, port), workers, cache_bytes, compression, particle_count)
+    print(f"Serving on http://{host}:{server.server_port}/art?emotion=Calm&seed=42&w=1024&h=768 "
+          f"({workers} worker(s), metrics at /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Emotion-Based Art Generator")
+    parser.add_argument("--particles", type=int, default=PARTICLE_COUNT, help="number of particles in the Excited animation")
+    parser.add_argument("--compression", type=int, choices=range(10), default=PNG_COMPRESSION, metavar="0-9",
+                        help="zlib level for saved PNGs")
+    parser.add_argument("--max-fps", type=int, default=ANIMATION_FPS, help="frame cap while the artwork is animated")
+    parser.add_argument("--profile", action="store_true", help="start with the frame profiler overlay on (F3 toggles it)")
+    parser.add_argument("--profile-trace", metavar="PATH", help="record per-frame stage timings to a .csv or .json file")
+    parser.add_argument("--no-audio", dest="audio", action="store_false", help="never open an audio device (no music)")
+    commands = parser.add_subparsers(dest="command")
+
+    render = commands.add_parser("render", help="render artworks headless in batch")
+    render.add_argument("--emotion", choices=list(EMOTION_PALETTES), required=True)
+    render.add_argument("--count", type=int, default=1)
+    render.add_argument("--size", type=parse_size, default=(SCENE_WIDTH, SCENE_HEIGHT), help="image size as WIDTHxHEIGHT")
+    render.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    render.add_argument("--output-dir", default="rendered_art")
+    render.add_argument("--seed", type=int, default=None, help="base seed; image i uses seed + i")
+
+    export = commands.add_parser("export", help="render one high-resolution artwork in memory-bounded bands")
+    export.add_argument("--emotion", choices=list(EMOTION_PALETTES), required=True)
+    export.add_argument("--seed", type=int, default=None, help="scene seed (random if omitted)")
+    export.add_argument("--size", type=parse_size, default=(7680, 4320), help="image size as WIDTHxHEIGHT")
+    export.add_argument("--workers", type=int, default=1, help="processes rendering bands in parallel")
+    export.add_argument("--band-rows", type=int, default=None, help="rows per band (default: fit EXPORT_TILE_BYTES)")
+    export.add_argument("--output", default=None, help="PNG path (default emotion_art_<emotion>_<size>.png)")
+
+    animate = commands.add_parser("animate", help="export the animation as a PNG sequence or raw video")
+    animate.add_argument("--emotion", choices=list(EMOTION_PALETTES), default="Excited")
+    animate.add_argument("--seed", type=int, default=None, help="scene seed (random if omitted)")
+    animate.add_argument("--size", type=parse_size, default=(1920, 1080), help="frame size as WIDTHxHEIGHT")
+    animate.add_argument("--duration", type=float, default=10.0, help="clip length in seconds")
+    animate.add_argument("--fps", type=int, default=ANIMATION_FPS)
+    animate.add_argument("--output-dir", default="animation_frames", help="directory for the PNG sequence")
+    animate.add_argument("--pipe", metavar="COMMAND",
+                         help="stream raw rgb24 frames to COMMAND's stdin instead, e.g. "
+                              "'ffmpeg -f rawvideo -pix_fmt rgb24 -s {width}x{height} -r {fps} -i - clip.mp4'")
+    animate.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="PNG encoding threads")
+
+    serve_parser = commands.add_parser("serve", help="serve artworks as PNGs over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    serve_parser.add_argument("--cache-mb", type=int, default=RESPONSE_CACHE_BYTES // (1024 * 1024),
+                              help="memory cap for cached PNG responses")
+    return parser
+
+
+def cli(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        if max(args.size) > MAX_EXPORT_SIZE:
+            parser.error(f"--size is limited to {MAX_EXPORT_SIZE} pixels per side")
+        output = args.output or f"emotion_art_{args.emotion}_{args.size[0]}x{args.size[1]}.png"
+        export_tiled(args.emotion, args.seed, args.size, output, args.workers, args.compression,
+                     args.particles, args.band_rows)
+    elif args.command == "serve":
+        serve(args.host, args.port, args.workers, args.cache_mb * 1024 * 1024, args.compression, args.particles)
+    elif args.command == "animate":
+        export_animation(args.emotion, args.seed, args.size, args.duration, args.fps, args.output_dir, args.pipe,
+                         args.workers, args.compression, args.particles)
+    elif args.command == "render":
+        render_batch(args.emotion, args.count, args.size, args.workers, args.output_dir, args.seed, args.compression,
+                     particle_count=args.particles)
+    else:
+        main(args.particles, args.compression, args.profile, args.profile_trace, args.max_fps, args.audio)
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file